@@ -1,8 +1,12 @@
+import base64
+import json
+import queue
+
 import cv2
 import numpy as np
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 
-from app.utils.face_detection import FaceDetector
+from app.utils.face_detection import FaceDetectorPool
 from app.utils.lipstick_renderer import LipstickRenderer
 from app.utils.recommendation import LipstickRecommender
 
@@ -10,43 +14,214 @@ from app.utils.recommendation import LipstickRecommender
 app = Flask(__name__)
 
 # 初始化組件
-face_detector = FaceDetector()
+# 每個請求從池中借用獨立的檢測器，避免多執行緒共用同一個MediaPipe圖
+face_detector_pool = FaceDetectorPool()
+DETECTOR_TIMEOUT = 30  # 等待可用檢測器的秒數
 lipstick_renderer = LipstickRenderer()
 recommender = LipstickRecommender()
 
+# 輸出圖片格式：cv2.imencode的副檔名、MIME類型與品質參數
+IMAGE_FORMATS = {
+    "jpg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "png": (".png", "image/png", None),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+STREAM_CHUNK_SIZE = 64 * 1024  # 串流回應每次送出的位元組數
+MAX_BATCH_SPECS = 32  # 批次試妝每個請求最多的色號數量
+
+def get_request_params():
+    """讀取請求參數
+    
+    上傳圖片時參數以multipart表單欄位傳送，其餘情況可使用JSON；
+    表單中的列表參數（如color_rgb）以JSON字串表示
+    
+    Returns:
+        params: 參數字典
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        return data
+    
+    params = {}
+    for key, value in request.form.items():
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+def encode_image(image, image_format="jpg", quality=90):
+    """在記憶體中將圖片編碼為指定格式
+    
+    Args:
+        image: BGR圖像
+        image_format: 輸出格式 [jpg|png|webp]
+        quality: jpg與webp的品質 (1-100)
+        
+    Returns:
+        buffer: 編碼後的位元組陣列
+        mime_type: 對應的MIME類型
+    """
+    ext, mime_type, quality_flag = IMAGE_FORMATS[image_format]
+    encode_params = [quality_flag, int(quality)] if quality_flag is not None else []
+    ok, buffer = cv2.imencode(ext, image, encode_params)
+    if not ok:
+        raise ValueError(f"無法編碼為{image_format}格式")
+    return buffer, mime_type
+
+def validate_spec(texture_type, color_rgb, opacity):
+    """檢查並轉換單個口紅設定
+    
+    Args:
+        texture_type: 質地類型 [matte|gloss|velvet]
+        color_rgb: 三個0-255整數組成的RGB列表
+        opacity: 不透明度 (0-1)，可為數字或數字字串
+        
+    Returns:
+        color_rgb: RGB元組
+        opacity: 轉換後的不透明度
+        message: 錯誤訊息，設定有效時為None
+    """
+    if texture_type not in ['matte', 'gloss', 'velvet']:
+        return None, None, "無效的質地類型"
+    
+    if (not isinstance(color_rgb, (list, tuple)) or len(color_rgb) != 3
+            or not all(isinstance(c, int) and not isinstance(c, bool) and 0 <= c <= 255
+                       for c in color_rgb)):
+        return None, None, "無效的顏色格式"
+    
+    try:
+        opacity = float(opacity)
+    except (TypeError, ValueError):
+        return None, None, "不透明度必須在0-1範圍內"
+    # NaN與任何數比較皆為False，以反向條件一併排除
+    if not 0 <= opacity <= 1:
+        return None, None, "不透明度必須在0-1範圍內"
+    
+    return tuple(color_rgb), opacity, None
+
+def get_image_options(params):
+    """讀取輸出圖片的格式與品質
+    
+    Args:
+        params: 請求參數，可包含 format [jpg|png|webp]（預設jpg）與 quality（預設90）
+        
+    Returns:
+        image_format: 圖片格式
+        quality: jpg與webp的品質
+        message: 錯誤訊息，參數有效時為None
+    """
+    image_format = str(params.get('format', 'jpg')).lower()
+    if image_format == 'jpeg':
+        image_format = 'jpg'
+    if image_format not in IMAGE_FORMATS:
+        return image_format, None, "無效的圖片格式"
+    
+    try:
+        quality = int(params.get('quality', 90))
+    except (TypeError, ValueError):
+        return image_format, None, "圖片品質必須在1-100範圍內"
+    if quality < 1 or quality > 100:
+        return image_format, quality, "圖片品質必須在1-100範圍內"
+    
+    return image_format, quality, None
+
+def get_output_options(params):
+    """讀取單張圖片回應的輸出方式、格式與品質
+    
+    Args:
+        params: 請求參數，可包含 output [json|binary]（預設json）、format 與 quality
+        
+    Returns:
+        output: 輸出方式
+        image_format: 圖片格式
+        quality: jpg與webp的品質
+        message: 錯誤訊息，參數有效時為None
+    """
+    image_format, quality, message = get_image_options(params)
+    output = params.get('output', 'json')
+    if message is None and output not in ('json', 'binary'):
+        message = "無效的輸出方式"
+    return output, image_format, quality, message
+
+def image_response(image, params):
+    """依照請求參數回傳處理後的圖片，不寫入磁碟
+    
+    Args:
+        image: 處理後的BGR圖像
+        params: 請求參數，可包含:
+            output: "json"（預設，以base64欄位回傳）或 "binary"（直接回傳圖片內容）
+            format: 圖片格式 [jpg|png|webp]，預設jpg
+            quality: jpg與webp的品質，預設90
+            stream: output為binary時是否以分塊串流回傳
+            
+    Returns:
+        Flask回應
+    """
+    output, image_format, quality, message = get_output_options(params)
+    if message is not None:
+        return jsonify({"status": "error", "message": message}), 400
+    
+    buffer, mime_type = encode_image(image, image_format, quality)
+    
+    if output == 'json':
+        return jsonify({
+            "status": "success",
+            "format": image_format,
+            "mime_type": mime_type,
+            "image_base64": base64.b64encode(buffer).decode('ascii')
+        })
+    
+    if params.get('stream') in (True, 'true', '1', 1):
+        data = memoryview(buffer)
+        
+        def generate():
+            for start in range(0, len(data), STREAM_CHUNK_SIZE):
+                yield bytes(data[start:start + STREAM_CHUNK_SIZE])
+        
+        return Response(generate(), mimetype=mime_type)
+    
+    return Response(buffer.tobytes(), mimetype=mime_type)
+
 @app.route('/api/v1/apply_lipstick', methods=['POST'])
 def apply_lipstick():
     """應用口紅試妝API
     
-    請求格式:
+    請求格式（multipart表單，image欄位為圖片，其餘欄位如下）:
     {
         "texture_type": "matte",  // [matte|gloss|velvet]
         "color_rgb": [255, 100, 80],
-        "opacity": 0.7  // 0-1
+        "opacity": 0.7,  // 0-1
+        "format": "jpg",  // 可選 [jpg|png|webp]
+        "quality": 90,  // 可選，jpg與webp的品質 1-100
+        "output": "json",  // 可選 [json|binary]
+        "stream": false  // 可選，output為binary時以分塊串流回傳
     }
     
-    回應:
+    回應（output為json時）:
     {
         "status": "success",
-        "processed_image_url": "path/to/image.jpg"
+        "format": "jpg",
+        "mime_type": "image/jpeg",
+        "image_base64": "..."
     }
+    output為binary時直接回傳編碼後的圖片內容
     """
     try:
         # 獲取請求數據
-        data = request.json
+        data = get_request_params()
         texture_type = data.get('texture_type', 'matte')
         color_rgb = data.get('color_rgb', [255, 0, 0])
-        opacity = float(data.get('opacity', 0.7))
         
         # 檢查參數有效性
-        if texture_type not in ['matte', 'gloss', 'velvet']:
-            return jsonify({"status": "error", "message": "無效的質地類型"}), 400
-        
-        if not isinstance(color_rgb, list) or len(color_rgb) != 3:
-            return jsonify({"status": "error", "message": "無效的顏色格式"}), 400
+        color_rgb, opacity, message = validate_spec(texture_type, color_rgb, data.get('opacity', 0.7))
+        if message is not None:
+            return jsonify({"status": "error", "message": message}), 400
         
-        if opacity < 0 or opacity > 1:
-            return jsonify({"status": "error", "message": "不透明度必須在0-1範圍內"}), 400
+        # 輸出參數在借用檢測器之前檢查，無效的請求不佔用檢測器
+        _, _, _, message = get_output_options(data)
+        if message is not None:
+            return jsonify({"status": "error", "message": message}), 400
         
         # 獲取上傳的圖片
         if 'image' not in request.files:
@@ -58,12 +233,14 @@ def apply_lipstick():
         image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
         
         # 檢測面部及唇部
-        landmarks, _ = face_detector.detect_face(image)
-        if landmarks is None:
-            return jsonify({"status": "error", "message": "未檢測到面部"}), 404
+        with face_detector_pool.acquire(timeout=DETECTOR_TIMEOUT) as face_detector:
+            landmarks, _ = face_detector.detect_face(image)
+            if landmarks is None:
+                return jsonify({"status": "error", "message": "未檢測到面部"}), 404
+            
+            # 獲取唇部遮罩
+            lip_mask = face_detector.get_lip_mask(image, landmarks)
         
-        # 獲取唇部遮罩
-        lip_mask = face_detector.get_lip_mask(image, landmarks)
         if lip_mask is None:
             return jsonify({"status": "error", "message": "未檢測到唇部"}), 404
         
@@ -76,15 +253,122 @@ def apply_lipstick():
             opacity=opacity
         )
         
-        # 保存處理後的圖片
-        output_filename = "processed_image.jpg"
-        cv2.imwrite(output_filename, result)
+        # 在記憶體中編碼並直接回傳，不寫入磁碟
+        return image_response(result, data)
         
+    except queue.Empty:
+        return jsonify({"status": "error", "message": "伺服器忙碌中，請稍後再試"}), 503
+    except Exception as e:
         return jsonify({
-            "status": "success",
-            "processed_image_url": output_filename
-        })
+            "status": "error",
+            "message": f"處理錯誤: {str(e)}"
+        }), 500
+
+@app.route('/api/v1/apply_lipstick_batch', methods=['POST'])
+def apply_lipstick_batch():
+    """同一張圖片一次套用多個色號
+    
+    面部與唇部檢測只執行一次，之後每個色號只在唇部區域內渲染
+    
+    請求格式（multipart表單，image欄位為圖片，其餘欄位如下）:
+    {
+        "specs": [
+            {"color_rgb": [255, 100, 80], "texture_type": "matte", "opacity": 0.7},
+            {"color_rgb": [200, 30, 60], "texture_type": "gloss", "opacity": 0.5}
+        ],
+        "patches_only": false,  // 可選，只回傳唇部區域的圖塊
+        "format": "jpg",  // 可選 [jpg|png|webp]
+        "quality": 90  // 可選，jpg與webp的品質 1-100
+    }
+    
+    回應:
+    {
+        "status": "success",
+        "format": "jpg",
+        "mime_type": "image/jpeg",
+        "images": ["...", "..."],  // 與specs順序相同的base64圖片
+        "bbox": [x, y, w, h]  // 僅patches_only時，圖塊在原圖中的位置
+    }
+    """
+    try:
+        # 獲取請求數據
+        data = get_request_params()
+        raw_specs = data.get('specs')
+        patches_only = data.get('patches_only') in (True, 'true', '1', 1)
+        
+        # 檢查參數有效性
+        if not isinstance(raw_specs, list) or not raw_specs:
+            return jsonify({"status": "error", "message": "未提供色號列表"}), 400
+        
+        if len(raw_specs) > MAX_BATCH_SPECS:
+            return jsonify({"status": "error", "message": f"色號數量不可超過{MAX_BATCH_SPECS}個"}), 400
+        
+        specs = []
+        for i, spec in enumerate(raw_specs):
+            if not isinstance(spec, dict):
+                return jsonify({"status": "error", "message": f"第{i + 1}個色號: 無效的格式"}), 400
+            texture_type = spec.get('texture_type', 'matte')
+            color_rgb = spec.get('color_rgb', [255, 0, 0])
+            color_rgb, opacity, message = validate_spec(texture_type, color_rgb, spec.get('opacity', 0.7))
+            if message is not None:
+                return jsonify({"status": "error", "message": f"第{i + 1}個色號: {message}"}), 400
+            specs.append((color_rgb, texture_type, opacity))
+        
+        image_format, quality, message = get_image_options(data)
+        if message is not None:
+            return jsonify({"status": "error", "message": message}), 400
+        
+        # 獲取上傳的圖片
+        if 'image' not in request.files:
+            return jsonify({"status": "error", "message": "未找到圖片"}), 400
+        
+        image_file = request.files['image']
+        image_data = image_file.read()
+        image_array = np.frombuffer(image_data, np.uint8)
+        image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+        
+        # 檢測面部及唇部（所有色號共用）
+        with face_detector_pool.acquire(timeout=DETECTOR_TIMEOUT) as face_detector:
+            landmarks, _ = face_detector.detect_face(image)
+            if landmarks is None:
+                return jsonify({"status": "error", "message": "未檢測到面部"}), 404
+            
+            # 只保存唇部外框內的小型遮罩
+            lip_mask = face_detector.get_lip_mask_roi(image, landmarks)
         
+        if lip_mask is None or not np.any(lip_mask.patch):
+            return jsonify({"status": "error", "message": "未檢測到唇部"}), 404
+        
+        # 唇部區域與遮罩層只計算一次，逐色號只渲染唇部圖塊
+        patches, bbox = lipstick_renderer.apply_lipstick_batch(
+            image, lip_mask, specs, return_patches=True
+        )
+        if bbox is None:
+            # 遮罩已確認非空，此時沒有結果代表渲染本身失敗
+            return jsonify({"status": "error", "message": "渲染口紅失敗"}), 500
+        
+        response = {"status": "success", "format": image_format, "mime_type": IMAGE_FORMATS[image_format][1]}
+        if patches_only:
+            response["bbox"] = [int(v) for v in bbox]
+        else:
+            # 所有色號共用一張整圖副本：每次只覆寫唇部區域並立即編碼，
+            # 記憶體中不會同時保留多張整圖
+            x, y, w, h = bbox
+            frame = image.copy()
+        
+        images = []
+        for patch in patches:
+            if not patches_only:
+                frame[y:y + h, x:x + w] = patch
+                patch = frame
+            buffer, _ = encode_image(patch, image_format, quality)
+            images.append(base64.b64encode(buffer).decode('ascii'))
+        response["images"] = images
+        
+        return jsonify(response)
+        
+    except queue.Empty:
+        return jsonify({"status": "error", "message": "伺服器忙碌中，請稍後再試"}), 503
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -115,8 +399,9 @@ def get_recommendations():
         hsv_values = None
         
         # 檢查是否直接提供了HSV值
-        if request.json and 'hsv_values' in request.json:
-            hsv_values = request.json['hsv_values']
+        params = get_request_params()
+        if 'hsv_values' in params:
+            hsv_values = params['hsv_values']
             if not isinstance(hsv_values, list) or len(hsv_values) != 3:
                 return jsonify({"status": "error", "message": "無效的HSV格式"}), 400
         
@@ -128,12 +413,13 @@ def get_recommendations():
             image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
             
             # 檢測面部
-            landmarks, _ = face_detector.detect_face(image)
-            if landmarks is None:
-                return jsonify({"status": "error", "message": "未檢測到面部"}), 404
-            
-            # 獲取膚色
-            hsv_values = face_detector.get_skin_tone(image, landmarks)
+            with face_detector_pool.acquire(timeout=DETECTOR_TIMEOUT) as face_detector:
+                landmarks, _ = face_detector.detect_face(image)
+                if landmarks is None:
+                    return jsonify({"status": "error", "message": "未檢測到面部"}), 404
+                
+                # 獲取膚色
+                hsv_values = face_detector.get_skin_tone(image, landmarks)
         else:
             # 如果既沒有提供HSV值也沒有上傳圖片，使用預設推薦
             pass
@@ -146,6 +432,8 @@ def get_recommendations():
             "recommendations": recommendations
         })
         
+    except queue.Empty:
+        return jsonify({"status": "error", "message": "伺服器忙碌中，請稍後再試"}), 503
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -1,6 +1,32 @@
 # 初始化utils包
-from app.utils.face_detection import FaceDetector
-from app.utils.lipstick_renderer import LipstickRenderer
-from app.utils.recommendation import LipstickRecommender
-from app.utils.clahe_enhancer import CLAHEEnhancer
-from app.utils.lipstick_library import get_all_brands, get_colors_for_brand, get_color_rgb, get_texture 
\ No newline at end of file
+# 採用延遲載入：只在實際使用某個類別或函式時才匯入對應模組，
+# 避免僅需色號庫或推薦功能的程式也載入mediapipe與cv2
+import importlib
+
+_LAZY_ATTRS = {
+    "FaceDetector": "app.utils.face_detection",
+    "LipstickRenderer": "app.utils.lipstick_renderer",
+    "LipstickRecommender": "app.utils.recommendation",
+    "CLAHEEnhancer": "app.utils.clahe_enhancer",
+    "get_all_brands": "app.utils.lipstick_library",
+    "get_colors_for_brand": "app.utils.lipstick_library",
+    "get_color_rgb": "app.utils.lipstick_library",
+    "get_texture": "app.utils.lipstick_library",
+    "get_default_strength_by_texture": "app.utils.lipstick_library",
+    "get_shade_table": "app.utils.lipstick_library",
+    "get_shade": "app.utils.lipstick_library",
+    "ShadeIndex": "app.utils.lipstick_library",
+    "get_shade_index": "app.utils.lipstick_library",
+}
+
+__all__ = list(_LAZY_ATTRS)
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_ATTRS[name]), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
\ No newline at end of file
@@ -4,21 +4,32 @@ import numpy as np
 class CLAHEEnhancer:
     """光線補償增強工具，用於處理低光環境下的圖像，提高唇部檢測的準確性"""
     
-    def __init__(self, clip_limit=3.0, tile_grid_size=(8, 8)):
+    def __init__(self, clip_limit=3.0, tile_grid_size=(8, 8), brightness_threshold=100,
+                 reuse_frames=0, sample_size=64):
         """初始化CLAHE增強器
         
         Args:
             clip_limit: 對比度限制 (大於1的浮點數)
             tile_grid_size: 網格大小
+            brightness_threshold: 平均亮度低於此值時判定為低光環境
+            reuse_frames: 低光判斷結果沿用的幀數，用於視頻連續幀（0表示每次重新判斷）
+            sample_size: 估計亮度時的取樣邊長，圖像會以固定間隔抽樣到約此大小
         """
         self.clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size)
+        self.brightness_threshold = brightness_threshold
+        self.reuse_frames = reuse_frames
+        self.sample_size = sample_size
+        
+        # 視頻模式下沿用的低光判斷
+        self._cached_low_light = None
+        self._frames_left = 0
     
     def enhance(self, image):
         """增強圖像
         
         Args:
             image: 輸入的BGR圖像
-            
+        
         Returns:
             enhanced: 增強後的圖像
         """
@@ -37,36 +48,57 @@ class CLAHEEnhancer:
         
         return enhanced
     
-    def is_low_light(self, image):
-        """檢測圖像是否為低光環境
+    def estimate_brightness(self, image):
+        """以抽樣像素估計圖像平均亮度
         
         Args:
             image: 輸入的BGR圖像
-            
+        
         Returns:
-            is_low: 是否為低光環境
+            brightness: 平均亮度 (0-255)
         """
+        h, w = image.shape[:2]
+        step = max(1, max(h, w) // self.sample_size)
+        sample = np.ascontiguousarray(image[::step, ::step])
+        
         # 轉換為灰度圖
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gray = cv2.cvtColor(sample, cv2.COLOR_BGR2GRAY) if sample.ndim == 3 else sample
         
         # 計算平均亮度
-        avg_brightness = np.mean(gray)
+        return float(np.mean(gray))
+    
+    def is_low_light(self, image):
+        """檢測圖像是否為低光環境
         
+        Args:
+            image: 輸入的BGR圖像
+        
+        Returns:
+            is_low: 是否為低光環境
+        """
         # 如果平均亮度低於閾值，判定為低光環境
-        is_low = avg_brightness < 100
+        is_low = self.estimate_brightness(image) < self.brightness_threshold
         
         return is_low
     
     def process_image(self, image):
         """根據圖像光照條件進行處理
         
+        設定了reuse_frames時，低光判斷會沿用指定幀數後才重新估計
+        
         Args:
             image: 輸入的BGR圖像
-            
+        
         Returns:
             processed: 處理後的圖像
         """
-        if self.is_low_light(image):
+        if self._cached_low_light is None or self._frames_left <= 0:
+            self._cached_low_light = self.is_low_light(image)
+            self._frames_left = self.reuse_frames
+        else:
+            self._frames_left -= 1
+        
+        if self._cached_low_light:
             return self.enhance(image)
         else:
-            return image 
\ No newline at end of file
+            return image
\ No newline at end of file
@@ -0,0 +1,70 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+class DetectionCache:
+    """以圖片內容雜湊為鍵的檢測結果LRU快取
+
+    Streamlit每次調整控制項都會重新執行腳本，同一張上傳圖片的人臉特徵點與
+    唇部遮罩不會改變，快取後切換色號或強度時只需重新渲染
+    """
+
+    def __init__(self, max_entries=8):
+        """初始化快取
+
+        Args:
+            max_entries: 最多保留的圖片數量，超過時淘汰最久未使用的項目
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(image_bytes, *settings):
+        """根據圖片內容與檢測器設定產生快取鍵
+
+        Args:
+            image_bytes: 上傳圖片的原始位元組
+            *settings: 會影響檢測結果的檢測器設定
+
+        Returns:
+            key: 快取鍵字串
+        """
+        digest = hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+        return f"{digest}:{settings!r}"
+
+    def get(self, key):
+        """讀取快取項目
+
+        Args:
+            key: 快取鍵
+
+        Returns:
+            entry: 快取的檢測結果，不存在時返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        """寫入快取項目
+
+        Args:
+            key: 快取鍵
+            entry: 檢測結果
+        """
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """清空快取"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,24 +1,128 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
 import cv2
 import mediapipe as mp
 import numpy as np
 
+from app.utils.clahe_enhancer import CLAHEEnhancer
+from app.utils.frame_buffer_pool import FrameBufferPool
+from app.utils.lip_mask import rasterize_lip_mask
+from app.utils.skin_tone import SkinToneEstimator
+
+class FaceLandmarks:
+    """單張人臉的特徵點結果
+    
+    將MediaPipe的NormalizedLandmarkList一次性轉換為(N, 3)的float32陣列，
+    後續的人臉外框、唇部輪廓與膚色採樣點都以向量化索引計算
+    """
+    
+    def __init__(self, points, score=0.0):
+        """初始化人臉特徵點結果
+        
+        Args:
+            points: (N, 3)的正規化座標陣列 (x, y, z)
+            score: 人臉排序得分
+        """
+        self.points = np.asarray(points, dtype=np.float32)
+        self.score = score
+    
+    @classmethod
+    def from_mediapipe(cls, face_landmarks, score=0.0):
+        """從MediaPipe的NormalizedLandmarkList建立
+        
+        Args:
+            face_landmarks: MediaPipe輸出的單張人臉特徵點
+            score: 人臉排序得分
+            
+        Returns:
+            face: FaceLandmarks實例
+        """
+        points = np.array(
+            [(lm.x, lm.y, lm.z) for lm in face_landmarks.landmark],
+            dtype=np.float32
+        )
+        return cls(points, score)
+    
+    def __len__(self):
+        return len(self.points)
+    
+    def pixel_points(self, width, height, indices=None):
+        """獲取指定特徵點的像素座標
+        
+        Args:
+            width: 圖像寬度
+            height: 圖像高度
+            indices: 特徵點索引，None表示全部
+            
+        Returns:
+            points: (K, 2)的float32像素座標
+        """
+        points = self.points if indices is None else self.points[indices]
+        return points[:, :2] * np.array([width, height], dtype=np.float32)
+    
+    def bbox(self, width, height):
+        """計算人臉外框
+        
+        Args:
+            width: 圖像寬度
+            height: 圖像高度
+            
+        Returns:
+            bbox: (x_min, y_min, x_max, y_max)
+        """
+        xy = self.pixel_points(width, height)
+        x_min, y_min = xy.min(axis=0)
+        x_max, y_max = xy.max(axis=0)
+        return float(x_min), float(y_min), float(x_max), float(y_max)
+
+
+def _as_face_landmarks(landmarks):
+    """將特徵點統一轉換為FaceLandmarks，兼容直接傳入MediaPipe結果的舊調用方式"""
+    if landmarks is None or isinstance(landmarks, FaceLandmarks):
+        return landmarks
+    return FaceLandmarks.from_mediapipe(landmarks)
+
+
 class FaceDetector:
     """面部特徵檢測工具，負責唇部特徵提取"""
     
-    def __init__(self, max_num_faces=1):
+    SINGLE_STAGE_MAX_SIZE = 1280  # 單階段FaceMesh輸入圖像的最大尺寸
+    # 兩階段模式的參數
+    TWO_STAGE_MIN_SIZE = 1280  # 圖像最大邊超過此值時才以兩階段補檢，較小的圖像單階段已是原圖精度
+    DETECTION_MAX_SIZE = 640  # 第一階段人臉框檢測的圖像最大尺寸
+    DETECTION_TILE_GRID = 3  # 大圖第一階段的分塊數（每邊）
+    DETECTION_TILE_FACE_RATIO = 0.1  # 整張圖像找到的人臉都小於此比例（相對圖像最大邊）時才檢測分塊
+    CROP_EXPAND = 1.6  # 人臉框擴張比例，保留FaceMesh需要的周邊區域
+    CROP_MAX_SIZE = 512  # 第二階段人臉裁切圖的最大尺寸
+    VIDEO_CLAHE_REUSE_FRAMES = 15  # 視頻模式下低光判斷沿用的幀數
+    
+    def __init__(self, max_num_faces=1, static_image_mode=True, min_tracking_confidence=0.5,
+                 two_stage=False):
         """初始化MediaPipe面部檢測模型
         
         Args:
             max_num_faces: 最大檢測人臉數量
+            static_image_mode: 是否使用靜態圖像模式；設為False時啟用視頻追蹤模式，
+                只在追蹤丟失時重新檢測人臉，適用於攝像頭連續幀
+            min_tracking_confidence: 追蹤模式下的最低追蹤置信度，低於此值時重新檢測
+            two_stage: 是否啟用兩階段補檢：大圖單階段檢測到的人臉少於max_num_faces時，
+                先以快速人臉檢測找出人臉框，再對尚未檢測到的人臉裁切圖執行FaceMesh，
+                適用於高解析度的多人照片
         """
         self.max_num_faces = max_num_faces
-        self.mp_face_mesh = mp.solutions.face_mesh.FaceMesh(
-            static_image_mode=True,  # 使用靜態圖像模式提高精度
-            max_num_faces=max_num_faces,  # 支援多個人臉檢測
-            refine_landmarks=True,  # 啟用唇部精細定位
-            min_detection_confidence=0.5
-        )
+        self.static_image_mode = static_image_mode
+        self.min_tracking_confidence = min_tracking_confidence
+        self.two_stage = two_stage
+        self.mp_face_mesh = self._create_face_mesh()
+        self._create_two_stage_models()
+        self.clahe_enhancer = self._create_clahe_enhancer()
         self.mp_drawing = mp.solutions.drawing_utils
+        self.skin_tone_estimator = SkinToneEstimator()
+        # MediaPipe會複製輸入圖像，縮放與RGB轉換可重複使用同一組緩衝
+        self._buffers = FrameBufferPool(num_slots=1)
         
         # 定義唇部特徵點索引 - 擴充更多點以提高精確度
         # 嘴唇外圍點 - 順時鐘方向從上唇中心開始
@@ -33,24 +137,84 @@ class FaceDetector:
         
         # 所有唇部點
         self.all_lip_points = self.outer_lip_points + self.inner_lip_points
+        
+        # 索引陣列，供向量化取點使用
+        self._outer_lip_idx = np.array(self.outer_lip_points, dtype=np.intp)
+        self._inner_lip_idx = np.array(self.inner_lip_points, dtype=np.intp)
     
-    def reinitialize(self, max_num_faces=1):
+    def _create_face_mesh(self):
+        """根據目前設定建立FaceMesh模型
+        
+        Returns:
+            face_mesh: MediaPipe FaceMesh實例
+        """
+        return mp.solutions.face_mesh.FaceMesh(
+            static_image_mode=self.static_image_mode,  # 靜態圖像模式提高精度，視頻模式跨幀追蹤
+            max_num_faces=self.max_num_faces,  # 支援多個人臉檢測
+            refine_landmarks=True,  # 啟用唇部精細定位
+            min_detection_confidence=0.5,
+            min_tracking_confidence=self.min_tracking_confidence
+        )
+    
+    def _create_clahe_enhancer(self):
+        """建立光線補償增強器，視頻模式下沿用低光判斷以減少估計次數
+        
+        Returns:
+            enhancer: CLAHEEnhancer實例
+        """
+        reuse_frames = 0 if self.static_image_mode else self.VIDEO_CLAHE_REUSE_FRAMES
+        return CLAHEEnhancer(clip_limit=3.0, tile_grid_size=(8, 8), reuse_frames=reuse_frames)
+    
+    def _create_two_stage_models(self):
+        """建立兩階段模式使用的人臉框檢測器與單人臉FaceMesh"""
+        if not self.two_stage:
+            self.mp_face_detection = None
+            self.mp_crop_mesh = None
+            return
+        
+        self.mp_face_detection = mp.solutions.face_detection.FaceDetection(
+            model_selection=1,  # 全距離模型，可檢測團體照中較小的人臉
+            min_detection_confidence=0.5
+        )
+        self.mp_crop_mesh = mp.solutions.face_mesh.FaceMesh(
+            static_image_mode=True,
+            max_num_faces=1,
+            refine_landmarks=True,
+            min_detection_confidence=0.5
+        )
+    
+    @property
+    def settings(self):
+        """會影響檢測結果的設定，可作為快取鍵的一部分"""
+        return (self.max_num_faces, self.static_image_mode, self.two_stage)
+    
+    def close(self):
+        """釋放MediaPipe模型資源"""
+        self.mp_face_mesh.close()
+        if self.mp_face_detection is not None:
+            self.mp_face_detection.close()
+            self.mp_crop_mesh.close()
+    
+    def reinitialize(self, max_num_faces=1, static_image_mode=None, two_stage=None):
         """重新初始化檢測器以更新設定
         
         Args:
             max_num_faces: 最大檢測人臉數量
+            static_image_mode: 是否使用靜態圖像模式，None表示保持目前設定
+            two_stage: 是否使用兩階段檢測，None表示保持目前設定
         """
         # 釋放當前資源
-        self.mp_face_mesh.close()
+        self.close()
         
         # 更新設定並重新初始化
         self.max_num_faces = max_num_faces
-        self.mp_face_mesh = mp.solutions.face_mesh.FaceMesh(
-            static_image_mode=True,
-            max_num_faces=max_num_faces,
-            refine_landmarks=True,
-            min_detection_confidence=0.5
-        )
+        if static_image_mode is not None:
+            self.static_image_mode = static_image_mode
+        if two_stage is not None:
+            self.two_stage = two_stage
+        self.mp_face_mesh = self._create_face_mesh()
+        self._create_two_stage_models()
+        self.clahe_enhancer = self._create_clahe_enhancer()
     
     def detect_face(self, image):
         """檢測面部特徵點 (兼容舊的單人臉檢測接口)
@@ -75,239 +239,282 @@ class FaceDetector:
         """檢測多個面部特徵點
         
         Args:
-            image: 輸入的RGB圖像
+            image: 輸入的BGR圖像
             
         Returns:
-            landmarks_list: 面部特徵點列表
+            landmarks_list: FaceLandmarks列表，依得分由高至低排序
         """
+        # 調整圖像大小以提高處理速度和穩定性 - 最大尺寸1280像素
+        # MediaPipe輸出的是正規化座標，縮放不影響後續座標換算，無需保存縮放比例
+        results = self.mp_face_mesh.process(self._prepare_image(image, self.SINGLE_STAGE_MAX_SIZE))
+        faces = [
+            FaceLandmarks.from_mediapipe(face_landmarks)
+            for face_landmarks in (results.multi_face_landmarks or [])
+        ]
+        
+        # 只有大圖且單階段漏檢時才執行較慢的兩階段補檢
+        if (self.two_stage and len(faces) < self.max_num_faces
+                and max(image.shape[:2]) > self.TWO_STAGE_MIN_SIZE):
+            faces = self._detect_two_stage(image, faces)
+        
+        return self._rank_faces(faces, image.shape[1], image.shape[0])
+    
+    def _prepare_image(self, image, max_size):
+        """將圖像縮小、視光線條件增強對比度並轉為RGB，作為MediaPipe的輸入
+        
+        Args:
+            image: 輸入的BGR圖像
+            max_size: 最大邊長，超過時等比例縮小
+            
+        Returns:
+            enhanced_image: 處理後的RGB圖像
+        """
+        h, w = image.shape[:2]
+        if max(h, w) > max_size:
+            scale = max_size / max(h, w)
+            size = (int(w*scale), int(h*scale))
+            resized = self._buffers.get("resized", (size[1], size[0]) + image.shape[2:], image.dtype)
+            image = cv2.resize(image, size, dst=resized)
+        
+        # 只在低光環境下增強對比度以改善檢測，光線充足時省去LAB色彩空間轉換
+        image = self.clahe_enhancer.process_image(image)
+        
         # 確保圖像為RGB格式
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB) if len(image.shape) == 3 and image.shape[2] == 3 else image
+        if len(image.shape) == 3 and image.shape[2] == 3:
+            rgb = self._buffers.get("rgb", image.shape, image.dtype)
+            return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=rgb)
+        return image
+    
+    def _detect_two_stage(self, image, known_faces=()):
+        """兩階段檢測：先找人臉框，再對每個人臉裁切圖執行FaceMesh
         
-        # 調整圖像大小以提高處理速度和穩定性 - 最大尺寸1280像素
-        h, w = image_rgb.shape[:2]
-        if max(h, w) > 1280:
-            scale = 1280 / max(h, w)
-            image_rgb = cv2.resize(image_rgb, (int(w*scale), int(h*scale)))
-            # 記錄縮放比例用於後續還原座標
-            self.scale_factor = 1/scale
-        else:
-            self.scale_factor = 1.0
+        處理量與人臉數量成正比而非圖像像素數，且小人臉能以較高解析度定位
+        
+        Args:
+            image: 輸入的BGR圖像
+            known_faces: 已檢測到的FaceLandmarks，中心落在這些人臉內的人臉框不再重複處理
             
-        # 增強圖像對比度以改善弱光環境下的檢測
-        lab = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2LAB)
-        l, a, b = cv2.split(lab)
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-        l = clahe.apply(l)
-        lab = cv2.merge((l, a, b))
-        enhanced_image = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
-        
-        # 處理圖像
-        results = self.mp_face_mesh.process(enhanced_image)
-        
-        # 如果檢測到面部，返回所有人臉的特徵點
-        landmarks_list = []
-        if results.multi_face_landmarks:
-            # 對於多人臉處理，我們按面積大小排序
-            face_info = []
+        Returns:
+            faces: 以整張圖像正規化座標表示的FaceLandmarks列表（包含known_faces）
+        """
+        height, width = image.shape[:2]
+        faces = list(known_faces)
+        
+        # 第一階段：快速找出人臉框
+        boxes = self._detect_face_boxes(image)
+        if not boxes:
+            return faces
+        
+        known_boxes = [face.bbox(width, height) for face in faces]
+        for box_x, box_y, box_w, box_h in boxes:
+            # 已由單階段檢測到的人臉不必再裁切檢測
+            center_x = box_x + box_w / 2
+            center_y = box_y + box_h / 2
+            if any(x0 <= center_x <= x1 and y0 <= center_y <= y1 for x0, y0, x1, y1 in known_boxes):
+                continue
             
-            for i, face_landmarks in enumerate(results.multi_face_landmarks):
-                h, w = image.shape[:2]
-                x_min = w
-                y_min = h
-                x_max = 0
-                y_max = 0
-                
-                for landmark in face_landmarks.landmark:
-                    x, y = int(landmark.x * w), int(landmark.y * h)
-                    x_min = min(x_min, x)
-                    y_min = min(y_min, y)
-                    x_max = max(x_max, x)
-                    y_max = max(y_max, y)
-                
-                area = (x_max - x_min) * (y_max - y_min)
-                center = ((x_min + x_max) // 2, (y_min + y_max) // 2)
-                
-                # 計算到圖像中心的距離，用於評分
-                img_center = (image.shape[1] // 2, image.shape[0] // 2)
-                distance_to_center = ((center[0] - img_center[0]) ** 2 + (center[1] - img_center[1]) ** 2) ** 0.5
-                
-                # 我們將人臉按面積大小排序，但也考慮中心位置
-                # 面積越大，距離中心越近，得分越高
-                score = area - (distance_to_center * 0.5)  # 調整權重
+            # 以人臉框中心擴張為正方形裁切區域
+            side = max(box_w, box_h) * self.CROP_EXPAND
+            x0 = int(max(0, center_x - side / 2))
+            y0 = int(max(0, center_y - side / 2))
+            x1 = int(min(width, center_x + side / 2))
+            y1 = int(min(height, center_y + side / 2))
+            if x1 - x0 < 16 or y1 - y0 < 16:
+                continue
+            
+            # 第二階段：對裁切圖執行FaceMesh
+            crop = image[y0:y1, x0:x1]
+            crop_results = self.mp_crop_mesh.process(self._prepare_image(crop, self.CROP_MAX_SIZE))
+            if not crop_results.multi_face_landmarks:
+                continue
+            
+            # 將裁切圖的正規化座標映射回整張圖像
+            face = FaceLandmarks.from_mediapipe(crop_results.multi_face_landmarks[0])
+            crop_w, crop_h = x1 - x0, y1 - y0
+            face.points[:, 0] = (x0 + face.points[:, 0] * crop_w) / width
+            face.points[:, 1] = (y0 + face.points[:, 1] * crop_h) / height
+            face.points[:, 2] *= crop_w / width
+            faces.append(face)
+        
+        return faces
+    
+    def _detect_face_boxes(self, image):
+        """以快速人臉檢測模型找出人臉框
+        
+        人臉檢測模型在人臉小於畫面約6%時會漏檢，因此大圖在整張圖像找到的人臉
+        少於max_num_faces，且沒有找到人臉或找到的人臉都很小（遠距離的團體照）時，
+        另外對重疊的分塊各檢測一次，最後以非極大值抑制合併結果
+        
+        Args:
+            image: 輸入的BGR圖像
+            
+        Returns:
+            boxes: 依置信度排序的人臉框列表 [(x, y, w, h), ...]，像素座標
+        """
+        height, width = image.shape[:2]
+        grid = self.DETECTION_TILE_GRID
+        
+        # 先整體縮小一次，使每個分塊約為檢測尺寸，避免在原圖上做色彩轉換
+        tiled = max(height, width) > self.DETECTION_MAX_SIZE * 2
+        small_size = self.DETECTION_MAX_SIZE * grid / 1.5 if tiled else self.DETECTION_MAX_SIZE
+        # 人臉框檢測不需要抗鋸齒，以INTER_LINEAR縮小，只讀取少量原圖像素
+        factor = int(np.ceil(max(height, width) / small_size))
+        scale = 1.0 / factor
+        small = image
+        if factor > 1:
+            small = cv2.resize(image, (width // factor, height // factor), interpolation=cv2.INTER_LINEAR)
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+        small_h, small_w = small.shape[:2]
+        
+        boxes = []
+        scores = []
+        
+        def detect_regions(regions):
+            for rx, ry, rw, rh in regions:
+                region = small[ry:ry + rh, rx:rx + rw]
+                if max(rw, rh) > self.DETECTION_MAX_SIZE:
+                    region_scale = self.DETECTION_MAX_SIZE / max(rw, rh)
+                    region = cv2.resize(region, (int(rw*region_scale), int(rh*region_scale)), interpolation=cv2.INTER_AREA)
                 
-                face_info.append((face_landmarks, score, i))
+                results = self.mp_face_detection.process(np.ascontiguousarray(region))
+                for detection in results.detections or []:
+                    # 將人臉框換算回原圖像素座標
+                    box = detection.location_data.relative_bounding_box
+                    boxes.append([
+                        int((rx + box.xmin * rw) / scale), int((ry + box.ymin * rh) / scale),
+                        int(box.width * rw / scale), int(box.height * rh / scale)
+                    ])
+                    scores.append(float(detection.score[0]))
+        
+        # 先檢測整張圖像
+        detect_regions([(0, 0, small_w, small_h)])
+        
+        # 大圖在整張圖像找到的人臉不足且都很小時，再檢測重疊的分塊（每塊為圖像的1.5/grid）
+        min_face_side = self.DETECTION_TILE_FACE_RATIO * max(height, width)
+        if (tiled and len(boxes) < self.max_num_faces
+                and all(max(box[2], box[3]) < min_face_side for box in boxes)):
+            tile_w = int(small_w / grid * 1.5)
+            tile_h = int(small_h / grid * 1.5)
+            detect_regions([
+                (min(int(col * small_w / grid), small_w - tile_w),
+                 min(int(row * small_h / grid), small_h - tile_h),
+                 tile_w, tile_h)
+                for row in range(grid)
+                for col in range(grid)
+            ])
+        
+        if not boxes:
+            return []
+        
+        # 合併分塊之間重複的人臉框
+        keep = cv2.dnn.NMSBoxes(boxes, scores, 0.5, 0.3)
+        keep = sorted(np.array(keep).reshape(-1).tolist(), key=lambda i: scores[i], reverse=True)
+        
+        # 只處理可能保留的人臉數量，再多保留一些候選
+        return [tuple(boxes[i]) for i in keep[:self.max_num_faces * 2]]
+    
+    def _rank_faces(self, faces, width, height):
+        """依人臉面積與位置評分並排序
+        
+        Args:
+            faces: FaceLandmarks列表
+            width: 圖像寬度
+            height: 圖像高度
+            
+        Returns:
+            landmarks_list: 依得分由高至低排序的FaceLandmarks列表
+        """
+        # 對於多人臉處理，我們按面積大小排序
+        img_center = np.array([width // 2, height // 2], dtype=np.float32)
+        
+        for face in faces:
+            x_min, y_min, x_max, y_max = face.bbox(width, height)
             
-            # 按得分降序排序
-            face_info.sort(key=lambda x: x[1], reverse=True)
+            area = (x_max - x_min) * (y_max - y_min)
+            center = np.array([(x_min + x_max) / 2, (y_min + y_max) / 2], dtype=np.float32)
             
-            # 限制返回的人臉數量不超過設定的最大值
-            for landmarks, _, _ in face_info[:self.max_num_faces]:
-                landmarks_list.append(landmarks)
+            # 計算到圖像中心的距離，用於評分
+            distance_to_center = float(np.linalg.norm(center - img_center))
             
-        return landmarks_list
+            # 我們將人臉按面積大小排序，但也考慮中心位置
+            # 面積越大，距離中心越近，得分越高
+            face.score = area - (distance_to_center * 0.5)  # 調整權重
+        
+        # 按得分降序排序
+        faces = sorted(faces, key=lambda face: face.score, reverse=True)
+        
+        # 限制返回的人臉數量不超過設定的最大值
+        return faces[:self.max_num_faces]
     
-    def get_lip_mask(self, image, landmarks):
-        """獲取唇部遮罩
+    def get_lip_mask(self, image, landmarks, out=None):
+        """獲取唇部遮罩 (兼容舊的全圖遮罩接口)
         
         Args:
             image: 輸入圖像
             landmarks: 面部特徵點
+            out: 可選的輸出緩衝，需為與圖像同尺寸的單通道uint8陣列
             
         Returns:
-            mask: 唇部區域的二值遮罩
+            mask: 與圖像同尺寸的唇部遮罩（邊緣抗鋸齒）
         """
-        if landmarks is None:
+        lip_mask = self.get_lip_mask_roi(image, landmarks)
+        if lip_mask is None:
             return None
+        return lip_mask.to_full(out=out)
+    
+    def get_lip_mask_roi(self, image, landmarks):
+        """在唇部外框內生成唇部遮罩
         
-        height, width = image.shape[:2]
-        mask = np.zeros((height, width), dtype=np.uint8)
+        遮罩只在唇部外框內以次像素精度與抗鋸齒單次繪製，
+        處理量與唇部面積成正比，而不是整張圖像
         
-        # 1. 提取唇部外輪廓點
-        outer_points = []
-        for idx in self.outer_lip_points:
-            try:
-                landmark = landmarks.landmark[idx]
-                x, y = int(landmark.x * width), int(landmark.y * height)
-                # 應用縮放係數還原座標
-                x, y = int(x * self.scale_factor), int(y * self.scale_factor)
-                outer_points.append((x, y))
-            except IndexError:
-                continue
+        Args:
+            image: 輸入圖像
+            landmarks: 面部特徵點
+            
+        Returns:
+            lip_mask: LipMask唇部遮罩（外框與小型遮罩）
+        """
+        landmarks = _as_face_landmarks(landmarks)
+        if landmarks is None:
+            return None
         
-        # 2. 提取唇部內輪廓點
-        inner_points = []
-        for idx in self.inner_lip_points:
-            try:
-                landmark = landmarks.landmark[idx]
-                x, y = int(landmark.x * width), int(landmark.y * height)
-                # 應用縮放係數還原座標
-                x, y = int(x * self.scale_factor), int(y * self.scale_factor)
-                inner_points.append((x, y))
-            except IndexError:
-                continue
+        height, width = image.shape[:2]
         
-        # 確保有足夠的點來創建遮罩
-        if len(outer_points) <= 3 or len(inner_points) <= 3:
+        # 確保特徵點數量足以涵蓋所有唇部索引
+        if len(landmarks) <= max(self.all_lip_points):
             return None
         
-        # 唇部檢測改進：對點進行處理以創建更平滑的唇形
+        # 1. 提取唇部外輪廓點與內輪廓點（保留次像素精度）
+        outer_points = landmarks.pixel_points(width, height, self._outer_lip_idx)
+        inner_points = landmarks.pixel_points(width, height, self._inner_lip_idx)
         
-        # 3. 檢查唇部是否閉合，如果唇部非常靠近，則視為閉合
+        # 2. 檢查唇部是否閉合，如果唇部非常靠近，則視為閉合
         is_mouth_closed = self._is_mouth_closed(landmarks, width, height)
         
-        # 4. 繪製外輪廓
-        outer_lip_np = np.array(outer_points, dtype=np.int32)
-        cv2.fillPoly(mask, [outer_lip_np], 255)
-        
-        # 5. 如果嘴巴未閉合，則挖空內部區域
-        if not is_mouth_closed:
-            inner_lip_np = np.array(inner_points, dtype=np.int32)
-            cv2.fillPoly(mask, [inner_lip_np], 0)
-        
-        # 6. 應用形態學平滑處理
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-        
-        # 7. 獲取唇部角度，如果唇部傾斜，則調整形狀
-        angle = self._get_lip_angle(outer_points)
-        if abs(angle) > 10:  # 如果唇部傾斜超過10度
-            try:
-                # 創建旋轉矩陣
-                # 修復中心點計算方式，確保返回整數元組
-                center_x = int(np.mean([p[0] for p in outer_points]))
-                center_y = int(np.mean([p[1] for p in outer_points]))
-                center = (center_x, center_y)
-                
-                M = cv2.getRotationMatrix2D(center, angle, 1.0)
-                
-                # 旋轉遮罩
-                rotated_mask = cv2.warpAffine(mask, M, (width, height))
-                
-                # 應用更多圓潤處理
-                rotated_mask = cv2.GaussianBlur(rotated_mask, (9, 9), 0)
-                _, rotated_mask = cv2.threshold(rotated_mask, 50, 255, cv2.THRESH_BINARY)
-                
-                # 旋轉回原始角度
-                M_back = cv2.getRotationMatrix2D(center, -angle, 1.0)
-                mask = cv2.warpAffine(rotated_mask, M_back, (width, height))
-            except Exception as e:
-                print(f"Warning: 旋轉唇形時出錯: {e}")
-                # 出錯時使用原始遮罩
-                pass
-        
-        # 8. 最終處理：邊緣平滑
-        mask = cv2.GaussianBlur(mask, (7, 7), 0)
-        _, mask = cv2.threshold(mask, 50, 255, cv2.THRESH_BINARY)
-        
-        # 9. 提高邊緣質量
-        mask = cv2.dilate(mask, None, iterations=1)
-        mask = cv2.erode(mask, None, iterations=1)
-        
-        return mask
+        # 3. 以平滑樣條與抗鋸齒一次繪製柔邊遮罩
+        return rasterize_lip_mask(outer_points, inner_points, (height, width), is_mouth_closed)
     
     def _is_mouth_closed(self, landmarks, width, height):
         """檢查嘴巴是否閉合
         
         Args:
-            landmarks: 面部特徵點
+            landmarks: FaceLandmarks面部特徵點
             width: 圖像寬度
             height: 圖像高度
             
         Returns:
             is_closed: 是否閉合
         """
-        # 上唇中心點和下唇中心點
-        top_lip = landmarks.landmark[13]
-        bottom_lip = landmarks.landmark[14]
-        
-        # 計算垂直距離
-        top_y = top_lip.y * height
-        bottom_y = bottom_lip.y * height
+        # 上唇中心點、下唇中心點、鼻樑與下巴的垂直座標
+        top_y, bottom_y, nose_top, chin = landmarks.points[[13, 14, 168, 152], 1] * height
         
         # 計算臉部高度作為參考
-        nose_top = landmarks.landmark[168].y * height
-        chin = landmarks.landmark[152].y * height
         face_height = chin - nose_top
         
         # 如果唇間距離小於臉部高度的4%，視為閉合
         return (bottom_y - top_y) < (face_height * 0.04)
     
-    def _get_lip_angle(self, lip_points):
-        """計算唇部角度
-        
-        Args:
-            lip_points: 唇部點的列表
-            
-        Returns:
-            angle: 唇部傾斜角度（度）
-        """
-        if len(lip_points) < 2:
-            return 0
-            
-        # 獲取左右兩個點
-        points = np.array(lip_points)
-        leftmost_idx = np.argmin(points[:, 0])
-        rightmost_idx = np.argmax(points[:, 0])
-        
-        # 如果點太靠近，返回0
-        if rightmost_idx == leftmost_idx:
-            return 0
-            
-        # 計算角度
-        left_point = points[leftmost_idx]
-        right_point = points[rightmost_idx]
-        
-        delta_x = right_point[0] - left_point[0]
-        delta_y = right_point[1] - left_point[1]
-        
-        # 防止除零錯誤
-        if delta_x == 0:
-            return 90
-            
-        # 計算角度（度）
-        angle = np.degrees(np.arctan2(delta_y, delta_x))
-        return angle
-    
     def get_skin_tone(self, image, landmarks):
         """獲取膚色調
         
@@ -318,37 +525,78 @@ class FaceDetector:
         Returns:
             hsv_values: HSV色值
         """
-        if landmarks is None:
-            return None
-        
-        height, width = image.shape[:2]
-        
-        # 使用臉頰和額頭區域採樣膚色 - 更可靠
-        forehead_point = landmarks.landmark[10]  # 額頭特徵點
-        left_cheek = landmarks.landmark[123]  # 左臉頰
-        right_cheek = landmarks.landmark[352]  # 右臉頰
-        
-        sample_points = [
-            (int(forehead_point.x * width), int(forehead_point.y * height)),
-            (int(left_cheek.x * width), int(left_cheek.y * height)),
-            (int(right_cheek.x * width), int(right_cheek.y * height))
-        ]
-        
-        # 從多個區域採樣並計算平均值
-        samples = []
-        roi_size = 15
+        # 在額頭與兩頰多個區域取樣並剔除異常值
+        return self.skin_tone_estimator.estimate(image, _as_face_landmarks(landmarks))
+
+
+class FaceDetectorPool:
+    """執行緒安全的FaceDetector池
+    
+    每個FaceDetector持有獨立的MediaPipe圖，同一時間只借給一個請求使用。
+    檢測器在需要時才建立，數量不超過池的大小，用完後歸還供下一個請求重用
+    """
+    
+    def __init__(self, size=None, **detector_kwargs):
+        """初始化檢測器池
         
-        for x, y in sample_points:
-            roi = image[max(0, y-roi_size):min(height, y+roi_size), 
-                         max(0, x-roi_size):min(width, x+roi_size)]
-            if roi.size > 0:
-                # 轉換為HSV色彩空間
-                roi_hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
-                # 計算該區域的平均HSV值
-                samples.append(np.mean(roi_hsv, axis=(0, 1)))
+        Args:
+            size: 最大檢測器數量，None表示使用CPU核心數
+            **detector_kwargs: 傳給FaceDetector的參數
+        """
+        self.size = size or os.cpu_count() or 1
+        self._detector_kwargs = detector_kwargs
+        self._available = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def acquire(self, timeout=None):
+        """借出一個檢測器，離開with區塊時自動歸還
         
-        if not samples:
-            return None
+        Args:
+            timeout: 等待可用檢測器的秒數，None表示一直等待
             
-        # 返回平均膚色
-        return np.mean(samples, axis=0) 
\ No newline at end of file
+        Yields:
+            detector: FaceDetector實例
+            
+        Raises:
+            queue.Empty: 等待逾時仍無可用的檢測器
+        """
+        detector = self._checkout(timeout)
+        try:
+            yield detector
+        finally:
+            self._available.put(detector)
+    
+    def _checkout(self, timeout):
+        """取得閒置的檢測器，未達上限時建立新的檢測器"""
+        try:
+            return self._available.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        
+        if can_create:
+            try:
+                return FaceDetector(**self._detector_kwargs)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        
+        return self._available.get(timeout=timeout)
+    
+    def close(self):
+        """釋放所有閒置檢測器的資源"""
+        while True:
+            try:
+                detector = self._available.get_nowait()
+            except queue.Empty:
+                break
+            detector.close()
+            with self._lock:
+                self._created -= 1
@@ -0,0 +1,53 @@
+import numpy as np
+
+class FrameBufferPool:
+    """視頻串流用的幀緩衝池
+
+    每個名稱保存數個與幀解析度相同的陣列並輪流使用，只有解析度或型別
+    改變時才重新配置。輪流使用多個緩衝，可讓上一幀的結果（例如追蹤器
+    保存的前一幀灰度圖，或仍在傳送中的輸出幀）在下一幀寫入時不被覆蓋
+    """
+
+    def __init__(self, num_slots=2):
+        """初始化緩衝池
+
+        Args:
+            num_slots: 每個名稱輪流使用的緩衝數量
+        """
+        self.num_slots = num_slots
+        self._buffers = {}
+        self._next_slot = {}
+
+    def get(self, name, shape, dtype=np.uint8):
+        """取得下一個可寫入的緩衝
+
+        Args:
+            name: 緩衝名稱，例如 "output" 或 "gray"
+            shape: 需要的陣列形狀
+            dtype: 需要的陣列型別
+
+        Returns:
+            buffer: 內容未定義的陣列，呼叫端需自行寫入
+        """
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+        slots = self._buffers.get(name)
+        if slots is None or slots[0].shape != shape or slots[0].dtype != dtype:
+            # 解析度改變時重新配置該名稱的所有緩衝
+            slots = [np.empty(shape, dtype=dtype) for _ in range(self.num_slots)]
+            self._buffers[name] = slots
+            self._next_slot[name] = 0
+
+        slot = self._next_slot[name]
+        self._next_slot[name] = (slot + 1) % self.num_slots
+        return slots[slot]
+
+    def clear(self):
+        """釋放所有緩衝"""
+        self._buffers.clear()
+        self._next_slot.clear()
+
+    @property
+    def nbytes(self):
+        """目前配置的緩衝總大小（位元組）"""
+        return sum(buf.nbytes for slots in self._buffers.values() for buf in slots)
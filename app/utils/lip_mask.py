@@ -0,0 +1,142 @@
+import cv2
+import numpy as np
+
+# 次像素繪製的定點小數位數 (1/16像素)
+_SUBPIXEL_SHIFT = 4
+
+class LipMask:
+    """唇部遮罩結果，只保存唇部外框內的小型遮罩，避免配置整張圖大小的陣列"""
+    
+    def __init__(self, patch, x, y, frame_shape):
+        """初始化唇部遮罩
+        
+        Args:
+            patch: 外框內的uint8遮罩（0-255，邊緣為抗鋸齒的柔和過渡）
+            x: 外框左上角的x座標
+            y: 外框左上角的y座標
+            frame_shape: 原始圖像的(高, 寬)
+        """
+        self.patch = patch
+        self.x = int(x)
+        self.y = int(y)
+        self.frame_shape = tuple(frame_shape[:2])
+    
+    @property
+    def bbox(self):
+        """外框 (x, y, w, h)"""
+        h, w = self.patch.shape[:2]
+        return self.x, self.y, w, h
+    
+    @property
+    def slices(self):
+        """外框在原始圖像中對應的切片 (rows, cols)"""
+        h, w = self.patch.shape[:2]
+        return slice(self.y, self.y + h), slice(self.x, self.x + w)
+    
+    def crop(self, image):
+        """從原始大小的圖像中裁切出與遮罩對應的區域
+        
+        Args:
+            image: 與原始圖像同尺寸的陣列
+        
+        Returns:
+            roi: 外框內的圖像視圖（不複製）
+        """
+        rows, cols = self.slices
+        return image[rows, cols]
+    
+    def to_full(self, out=None):
+        """展開為整張圖大小的遮罩，兼容舊的全圖遮罩接口
+        
+        Args:
+            out: 可選的輸出緩衝，需為與原始圖像同尺寸的uint8陣列
+        
+        Returns:
+            mask: 與原始圖像同尺寸的uint8遮罩
+        """
+        if out is None:
+            mask = np.zeros(self.frame_shape, dtype=np.uint8)
+        else:
+            mask = out
+            mask.fill(0)
+        rows, cols = self.slices
+        mask[rows, cols] = self.patch
+        return mask
+
+
+def smooth_closed_contour(points, samples_per_segment=4):
+    """以閉合Catmull-Rom樣條平滑輪廓點
+    
+    Args:
+        points: (N, 2)的輪廓點，依序排列
+        samples_per_segment: 每兩個相鄰點之間的取樣數
+    
+    Returns:
+        smoothed: (N * samples_per_segment, 2)的float32平滑輪廓
+    """
+    points = np.asarray(points, dtype=np.float32)
+    p0 = np.roll(points, 1, axis=0)
+    p1 = points
+    p2 = np.roll(points, -1, axis=0)
+    p3 = np.roll(points, -2, axis=0)
+    
+    t = np.arange(samples_per_segment, dtype=np.float32) / samples_per_segment
+    t2 = t * t
+    t3 = t2 * t
+    # Catmull-Rom基底係數 (samples, 4)
+    basis = 0.5 * np.stack([
+        -t3 + 2 * t2 - t,
+        3 * t3 - 5 * t2 + 2,
+        -3 * t3 + 4 * t2 + t,
+        t3 - t2
+    ], axis=1)
+    
+    # (N, 4, 2) 的控制點與基底相乘得到 (N, samples, 2)
+    control = np.stack([p0, p1, p2, p3], axis=1)
+    curve = np.einsum("sk,nkd->nsd", basis, control)
+    return curve.reshape(-1, 2)
+
+
+def rasterize_lip_mask(outer_points, inner_points, frame_shape, mouth_closed=False,
+                       samples_per_segment=4, margin=2):
+    """單次繪製抗鋸齒的唇部遮罩
+    
+    以樣條平滑內外輪廓後，用次像素精度與LINE_AA直接繪製柔邊遮罩，
+    取代形態學、旋轉、模糊、二值化等多道整圖濾波
+    
+    Args:
+        outer_points: (N, 2)的唇部外輪廓像素座標（可含小數）
+        inner_points: (M, 2)的唇部內輪廓像素座標
+        frame_shape: 原始圖像的(高, 寬)
+        mouth_closed: 嘴巴閉合時不挖空內輪廓
+        samples_per_segment: 樣條在每兩個輪廓點之間的取樣數
+        margin: 外框向外擴張的像素數，保留抗鋸齒邊緣
+    
+    Returns:
+        lip_mask: LipMask唇部遮罩，外框超出圖像時返回None
+    """
+    height, width = frame_shape[:2]
+    outer = smooth_closed_contour(outer_points, samples_per_segment)
+    
+    # 計算外框並限制在圖像範圍內
+    x0 = max(0, int(np.floor(outer[:, 0].min())) - margin)
+    y0 = max(0, int(np.floor(outer[:, 1].min())) - margin)
+    x1 = min(width, int(np.ceil(outer[:, 0].max())) + margin + 1)
+    y1 = min(height, int(np.ceil(outer[:, 1].max())) + margin + 1)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    
+    patch = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    offset = np.array([x0, y0], dtype=np.float32)
+    scale = 1 << _SUBPIXEL_SHIFT
+    
+    outer_fixed = np.round((outer - offset) * scale).astype(np.int32)
+    cv2.fillPoly(patch, [outer_fixed], 255, lineType=cv2.LINE_AA, shift=_SUBPIXEL_SHIFT)
+    
+    # 嘴巴張開時挖空內部區域
+    if not mouth_closed:
+        inner = smooth_closed_contour(inner_points, samples_per_segment)
+        inner_fixed = np.round((inner - offset) * scale).astype(np.int32)
+        cv2.fillPoly(patch, [inner_fixed], 0, lineType=cv2.LINE_AA, shift=_SUBPIXEL_SHIFT)
+    
+    return LipMask(patch, x0, y0, (height, width))
\ No newline at end of file
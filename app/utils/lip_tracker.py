@@ -0,0 +1,207 @@
+import cv2
+import numpy as np
+
+from app.utils.face_detection import FaceLandmarks
+
+class LipTracker:
+    """攝像頭幀間的唇部追蹤排程器
+
+    只在每N幀或動作較大時執行FaceDetector，其餘幀以稀疏光流(Lucas-Kanade)
+    推移唇部特徵點，並以指數移動平均消除抖動。N會依照測得的動作幅度自動調整：
+    使用者保持靜止時逐步拉長檢測間隔，動作變大時立即恢復逐幀檢測
+    """
+
+    # 除唇部外，膚色採樣與閉嘴判斷所需的特徵點
+    ANCHOR_POINTS = [10, 123, 352, 13, 14, 168, 152]
+
+    def __init__(self, face_detector, min_interval=1, max_interval=8,
+                 still_threshold=1.0, motion_threshold=6.0, smoothing=0.4,
+                 buffer_pool=None):
+        """初始化追蹤器
+
+        Args:
+            face_detector: 用於重新檢測的FaceDetector
+            min_interval: 最小檢測間隔（幀）
+            max_interval: 最大檢測間隔（幀）
+            still_threshold: 平均位移低於此值（像素）時視為靜止，拉長檢測間隔
+            motion_threshold: 平均位移高於此值（像素）時立即重新檢測
+            smoothing: 靜止時的平滑係數，越小越平滑（0-1）
+            buffer_pool: 可選的FrameBufferPool，灰度圖改寫入重複使用的緩衝
+        """
+        self.face_detector = face_detector
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.still_threshold = still_threshold
+        self.motion_threshold = motion_threshold
+        self.smoothing = smoothing
+        self.buffer_pool = buffer_pool
+
+        self.interval = min_interval
+        self.frames_since_detection = 0
+        self.last_motion = 0.0
+
+        self._track_idx = np.array(
+            sorted(set(face_detector.all_lip_points + self.ANCHOR_POINTS)),
+            dtype=np.intp
+        )
+        self._prev_gray = None
+        # 光流與檢測得到的原始特徵點，作為下一幀的追蹤起點
+        self._faces = []
+        # 上一幀返回的平滑特徵點，只用於指數移動平均
+        self._smoothed = []
+
+        self._lk_params = dict(
+            winSize=(15, 15),
+            maxLevel=2,
+            criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03)
+        )
+
+    def reset(self):
+        """清除追蹤狀態，下一幀將重新檢測"""
+        self._prev_gray = None
+        self._faces = []
+        self._smoothed = []
+        self.interval = self.min_interval
+        self.frames_since_detection = 0
+
+    def update(self, image):
+        """處理一幀並返回人臉特徵點
+
+        Args:
+            image: 輸入的BGR圖像
+
+        Returns:
+            landmarks_list: FaceLandmarks列表
+        """
+        if self.buffer_pool is not None:
+            # 緩衝池輪流使用兩個緩衝，上一幀的灰度圖不會被覆蓋
+            gray = self.buffer_pool.get("gray", image.shape[:2])
+            cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+        else:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        height, width = gray.shape[:2]
+
+        faces = None
+        motions = None
+        need_detection = (
+            self._prev_gray is None
+            or not self._faces
+            or self._prev_gray.shape != gray.shape
+            or self.frames_since_detection + 1 >= self.interval
+        )
+
+        if not need_detection:
+            tracked = self._track(gray, width, height)
+            # 追蹤失敗或動作過大時改為重新檢測
+            if tracked is not None and self.last_motion <= self.motion_threshold:
+                faces, motions = tracked
+
+        if faces is None:
+            faces = self.face_detector.detect_multiple_faces(image)
+            motions = self._detection_motion(faces, width, height)
+            self.frames_since_detection = 0
+        else:
+            self.frames_since_detection += 1
+
+        self._adapt_interval()
+        self._prev_gray = gray
+        # 追蹤狀態保留原始特徵點，平滑只作用在返回的副本上
+        self._faces = faces
+        self._smoothed = self._smooth(faces, motions)
+        return self._smoothed
+
+    def _track(self, gray, width, height):
+        """以光流推移上一幀的特徵點
+
+        Returns:
+            (faces, motions): 推移後的原始FaceLandmarks列表與各張臉的位移（像素），
+                追蹤失敗時返回None
+        """
+        scale = np.array([width, height], dtype=np.float32)
+        tracked_faces = []
+        motions = []
+
+        for face in self._faces:
+            prev_pts = face.points[self._track_idx, :2] * scale
+            next_pts, status, _ = cv2.calcOpticalFlowPyrLK(
+                self._prev_gray, gray, prev_pts.reshape(-1, 1, 2), None, **self._lk_params
+            )
+            if next_pts is None:
+                return None
+
+            status = status.reshape(-1).astype(bool)
+            # 超過三成的點追蹤失敗時放棄光流結果
+            if status.mean() < 0.7:
+                return None
+
+            next_pts = next_pts.reshape(-1, 2)
+            flow = next_pts - prev_pts
+            median_flow = np.median(flow[status], axis=0)
+            # 追蹤失敗的點以整體位移代替
+            flow[~status] = median_flow
+
+            motions.append(float(np.median(np.linalg.norm(flow, axis=1))))
+
+            points = face.points.copy()
+            # 未追蹤的特徵點跟隨整體位移
+            points[:, :2] += median_flow / scale
+            points[self._track_idx, :2] = (prev_pts + flow) / scale
+            tracked_faces.append(FaceLandmarks(points, face.score))
+
+        self.last_motion = max(motions) if motions else 0.0
+        return tracked_faces, motions
+
+    def _detection_motion(self, detected, width, height):
+        """計算新檢測結果相對上一幀原始特徵點的位移
+
+        Args:
+            detected: 新檢測到的FaceLandmarks列表
+            width: 圖像寬度
+            height: 圖像高度
+
+        Returns:
+            motions: 各張臉的位移（像素），人臉數量改變時返回None
+        """
+        if len(detected) != len(self._faces):
+            # 人臉數量改變時視為大幅動作，恢復逐幀檢測
+            self.last_motion = float("inf") if self._faces else 0.0
+            return None
+
+        scale = np.array([width, height], dtype=np.float32)
+        motions = []
+        for new_face, prev_face in zip(detected, self._faces):
+            delta = (new_face.points[self._track_idx, :2] - prev_face.points[self._track_idx, :2]) * scale
+            motions.append(float(np.median(np.linalg.norm(delta, axis=1))))
+
+        self.last_motion = max(motions) if motions else 0.0
+        return motions
+
+    def _smooth(self, faces, motions):
+        """以指數移動平均將原始特徵點與上一幀的輸出融合，消除抖動與重新檢測時的跳動
+
+        Args:
+            faces: 本幀的原始FaceLandmarks列表，不會被修改
+            motions: 各張臉的位移（像素），None表示不做平滑
+
+        Returns:
+            smoothed: 平滑後的FaceLandmarks副本列表
+        """
+        if motions is None or len(faces) != len(self._smoothed):
+            return [FaceLandmarks(face.points.copy(), face.score) for face in faces]
+
+        smoothed = []
+        for face, prev_face, motion in zip(faces, self._smoothed, motions):
+            # 根據動作幅度調整平滑係數：靜止時平滑較強，移動時跟隨較快
+            alpha = float(np.clip(motion / (2 * self.still_threshold), self.smoothing, 1.0))
+            points = prev_face.points + (face.points - prev_face.points) * alpha
+            smoothed.append(FaceLandmarks(points, face.score))
+        return smoothed
+
+    def _adapt_interval(self):
+        """依照最近的動作幅度調整檢測間隔"""
+        if self.last_motion > self.motion_threshold:
+            self.interval = self.min_interval
+        elif self.last_motion < self.still_threshold:
+            self.interval = min(self.max_interval, self.interval + 1)
+        else:
+            self.interval = max(self.min_interval, self.interval - 1)
@@ -1,3 +1,5 @@
+import numpy as np
+
 # 定義口紅色號庫
 LIPSTICK_COLORS = {
     'MAC': {
@@ -156,4 +158,232 @@ def get_texture(brand, color_name):
     """獲取特定品牌和色號的質地類型"""
     if brand in DEFAULT_TEXTURES and color_name in DEFAULT_TEXTURES[brand]:
         return DEFAULT_TEXTURES[brand][color_name]
-    return 'matte'  # 默認霧面質地 
\ No newline at end of file
+    return 'matte'  # 默認霧面質地 
+
+# 各質地的預設強度
+DEFAULT_STRENGTHS = {
+    'matte': 0.3,   # 霧面
+    'gloss': 0.6,   # 珠光
+    'velvet': 0.7   # 絲絨
+}
+
+def get_default_strength_by_texture(texture):
+    """獲取質地對應的預設強度"""
+    return DEFAULT_STRENGTHS.get(texture, 0.4)  # 默認值
+
+# 編譯後的色號表，第一次使用時才建立
+_shade_table = None
+_shade_lookup = {}
+_rgb_lookup = {}
+_cv2_module = None
+
+def _cv2():
+    """延遲載入cv2，只查詢色號資料的程式不需要載入OpenCV"""
+    global _cv2_module
+    if _cv2_module is None:
+        import cv2
+        _cv2_module = cv2
+    return _cv2_module
+
+def enhance_colors(rgb):
+    """批次計算渲染時使用的增強色彩
+
+    紅色系飽和度提高30%，其他顏色提高20%，明度提高10%
+
+    Args:
+        rgb: (N, 3)的RGB值
+
+    Returns:
+        enhanced_bgr: (N, 3)的uint8 BGR值
+    """
+    cv2 = _cv2()
+
+    rgb = np.asarray(rgb, dtype=np.uint8).reshape(-1, 1, 3)
+    hsv = cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV).reshape(-1, 3).astype(np.int32)
+    h, s, v = hsv[:, 0], hsv[:, 1], hsv[:, 2]
+
+    # 根據色相調整飽和度，紅色系增強更多
+    is_red = (h <= 20) | (h >= 160)
+    s = np.minimum(255, np.where(is_red, s * 1.3, s * 1.2).astype(np.int32))
+    # 提高明度，使顏色更鮮明
+    v = np.minimum(255, (v * 1.1).astype(np.int32))
+
+    enhanced_hsv = np.stack([h, s, v], axis=1).astype(np.uint8).reshape(-1, 1, 3)
+    enhanced_rgb = cv2.cvtColor(enhanced_hsv, cv2.COLOR_HSV2RGB).reshape(-1, 3)
+    return enhanced_rgb[:, ::-1].copy()
+
+def _compile_shade_table():
+    """將色號庫編譯為結構化的numpy陣列，每個色號一列"""
+    cv2 = _cv2()
+
+    rows = [
+        (brand, color_name, rgb, get_texture(brand, color_name))
+        for brand, colors in LIPSTICK_COLORS.items()
+        for color_name, rgb in colors.items()
+    ]
+
+    table = np.zeros(len(rows), dtype=[
+        ('brand', 'U32'),
+        ('name', 'U64'),
+        ('rgb', 'u1', 3),
+        ('hsv', 'u1', 3),
+        ('lab', 'f4', 3),
+        ('enhanced_bgr', 'u1', 3),
+        ('texture', 'U16'),
+        ('strength', 'f4')
+    ])
+    table['brand'] = [row[0] for row in rows]
+    table['name'] = [row[1] for row in rows]
+    table['rgb'] = [row[2] for row in rows]
+    table['texture'] = [row[3] for row in rows]
+    table['strength'] = [get_default_strength_by_texture(row[3]) for row in rows]
+
+    # 所有色號一次完成色彩空間轉換
+    rgb = table['rgb'].reshape(-1, 1, 3)
+    table['hsv'] = cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV).reshape(-1, 3)
+    # 以浮點輸入取得標準範圍的Lab (L: 0-100)，供色差計算使用
+    table['lab'] = cv2.cvtColor(rgb.astype(np.float32) / 255.0, cv2.COLOR_RGB2Lab).reshape(-1, 3)
+    table['enhanced_bgr'] = enhance_colors(table['rgb'])
+
+    table.setflags(write=False)
+    return table
+
+def get_shade_table():
+    """獲取編譯後的色號表
+
+    Returns:
+        table: 結構化陣列，欄位為 brand, name, rgb, hsv, lab, enhanced_bgr, texture, strength
+    """
+    global _shade_table
+    if _shade_table is None:
+        table = _compile_shade_table()
+        _shade_lookup.update(
+            ((str(row['brand']), str(row['name'])), i) for i, row in enumerate(table)
+        )
+        for i, row in enumerate(table):
+            _rgb_lookup.setdefault(tuple(int(c) for c in row['rgb']), i)
+        _shade_table = table
+    return _shade_table
+
+def get_shade(brand, color_name):
+    """獲取特定品牌和色號在色號表中的資料列，不存在時返回None"""
+    table = get_shade_table()
+    index = _shade_lookup.get((brand, color_name))
+    if index is None:
+        return None
+    return table[index]
+
+def get_enhanced_bgr(color_rgb):
+    """獲取渲染時使用的增強色彩，色號庫中的顏色直接查表
+
+    Args:
+        color_rgb: 口紅顏色的RGB值
+
+    Returns:
+        color_bgr: 增強後的BGR值 (b, g, r)
+    """
+    table = get_shade_table()
+    index = _rgb_lookup.get(tuple(int(c) for c in color_rgb))
+    if index is not None:
+        bgr = table['enhanced_bgr'][index]
+    else:
+        bgr = enhance_colors([color_rgb])[0]
+    return tuple(int(c) for c in bgr)
+
+def rgb_to_lab(rgb):
+    """將RGB值轉換為CIELAB (L: 0-100)
+
+    Args:
+        rgb: (3,)或(N, 3)的RGB值
+
+    Returns:
+        lab: (N, 3)的float32 Lab值
+    """
+    cv2 = _cv2()
+
+    rgb = np.asarray(rgb, dtype=np.float32).reshape(-1, 1, 3) / 255.0
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2Lab).reshape(-1, 3)
+
+class ShadeIndex:
+    """色號的最近鄰搜尋索引
+
+    以CIELAB空間的歐氏距離 (ΔE76) 比較顏色，比RGB距離更接近人眼感知。
+    距離以向量化方式一次計算所有候選色號，並以argpartition只排序前k名，
+    十萬個色號的查詢只需數毫秒
+    """
+
+    def __init__(self, table=None):
+        """初始化索引
+
+        Args:
+            table: 編譯後的色號表，未指定時使用內建色號庫
+        """
+        self.table = get_shade_table() if table is None else table
+        self._lab = np.ascontiguousarray(self.table['lab'], dtype=np.float32)
+
+        # 品牌與質地以整數編碼，篩選時不必逐一比較字串
+        self._brand_names, self._brand_codes = np.unique(self.table['brand'], return_inverse=True)
+        self._texture_names, self._texture_codes = np.unique(self.table['texture'], return_inverse=True)
+
+    def __len__(self):
+        return len(self.table)
+
+    def query(self, color_rgb, k=1, brands=None, textures=None):
+        """搜尋色差最小的k個色號
+
+        Args:
+            color_rgb: 目標顏色的RGB值
+            k: 返回的色號數量
+            brands: 只在這些品牌中搜尋，None表示不限
+            textures: 只搜尋這些質地，None表示不限
+
+        Returns:
+            results: 依色差由小到大排列的 (色號資料列, ΔE) 列表
+        """
+        if k <= 0:
+            return []
+
+        indices = None
+        if brands is not None or textures is not None:
+            candidates = np.ones(len(self.table), dtype=bool)
+            if brands is not None:
+                candidates &= self._filter_codes(self._brand_names, self._brand_codes, brands)
+            if textures is not None:
+                candidates &= self._filter_codes(self._texture_names, self._texture_codes, textures)
+            indices = np.flatnonzero(candidates)
+            if len(indices) == 0:
+                return []
+
+        lab = self._lab if indices is None else self._lab[indices]
+        diff = lab - rgb_to_lab(color_rgb)[0]
+        distances = np.einsum('ij,ij->i', diff, diff)
+
+        # 只對前k名排序
+        k = min(k, len(distances))
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest], kind='stable')]
+        rows = nearest if indices is None else indices[nearest]
+        return [(self.table[row], float(np.sqrt(distances[i]))) for row, i in zip(rows, nearest)]
+
+    @staticmethod
+    def _filter_codes(names, codes, wanted):
+        """將篩選條件轉為整數編碼後比對"""
+        # 單一字串視為一個篩選值，而不是逐字元比對
+        if isinstance(wanted, str):
+            wanted = [wanted]
+        wanted_codes = np.flatnonzero(np.isin(names, list(wanted)))
+        return np.isin(codes, wanted_codes)
+
+    def nearest(self, color_rgb, brands=None, textures=None):
+        """搜尋色差最小的色號，沒有符合條件的色號時返回None"""
+        results = self.query(color_rgb, k=1, brands=brands, textures=textures)
+        return results[0][0] if results else None
+
+_shade_index = None
+
+def get_shade_index():
+    """獲取內建色號庫的最近鄰索引，第一次使用時建立"""
+    global _shade_index
+    if _shade_index is None:
+        _shade_index = ShadeIndex()
+    return _shade_index
\ No newline at end of file
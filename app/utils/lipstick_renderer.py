@@ -1,123 +1,288 @@
+import threading
+
 import cv2
 import numpy as np
-from typing import Tuple, Optional, Union
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, List, Tuple, Optional, Union
+
+from app.utils.lip_mask import LipMask
+from app.utils.lipstick_library import get_enhanced_bgr
+
+
+@lru_cache(maxsize=8)
+def _texture_tile(texture_type: str, size: int, seed: int) -> np.ndarray:
+    """
+    以固定種子生成質地紋理貼圖，相同參數只生成一次
+    
+    Args:
+        texture_type: 質地類型，"matte" 或 "velvet"
+        size: 貼圖邊長
+        seed: 隨機種子
+        
+    Returns:
+        tile: 唯讀的float32貼圖，霧面為(size, size, 3)的噪點，絲絨為(size, size)的0-1紋理
+    """
+    rng = np.random.default_rng(seed)
+    
+    if texture_type == "velvet":
+        # 多個比例的噪聲疊加，形成絲絨的細微顆粒感
+        tile = np.zeros((size, size), dtype=np.float32)
+        for scale in [2, 5, 10]:
+            noise = rng.standard_normal((size // scale + 1, size // scale + 1)).astype(np.float32)
+            noise = cv2.resize(noise, (size, size))
+            tile += noise * (scale / 30.0)
+        
+        tile = cv2.GaussianBlur(tile, (3, 3), 0)
+        tile = (tile - tile.min()) / (tile.max() - tile.min() + 1e-8)
+    else:
+        # 霧面使用標準差為2的高斯噪點
+        tile = (rng.standard_normal((size, size, 3)) * 2.0).astype(np.float32)
+    
+    tile.setflags(write=False)
+    return tile
+
+
+@lru_cache(maxsize=32)
+def _highlight_gradient(bucket_h: int, bucket_w: int) -> np.ndarray:
+    """
+    生成以 (bucket_h, bucket_w) 為中心、兩倍外框大小的徑向高光漸變
+    
+    Args:
+        bucket_h: 取整後的唇部外框高度
+        bucket_w: 取整後的唇部外框寬度
+        
+    Returns:
+        gradient: 唯讀的(2 * bucket_h, 2 * bucket_w) float32漸變（0-1）
+    """
+    y, x = np.ogrid[:2 * bucket_h, :2 * bucket_w]
+    
+    # 計算到中心的距離
+    dist_from_center = np.sqrt((x - bucket_w) ** 2 + (y - bucket_h) ** 2).astype(np.float32)
+    
+    # 創建徑向漸變
+    max_dist = np.sqrt(bucket_h ** 2 + bucket_w ** 2) * 0.3  # 控制高光大小
+    gradient = np.clip(1 - dist_from_center / max_dist, 0, 1)
+    
+    gradient.setflags(write=False)
+    return gradient
+
 
 class LipstickRenderer:
     """口紅渲染器，負責將口紅效果應用到唇部"""
     
-    def __init__(self):
-        """初始化口紅渲染器"""
-        pass
+    # 唇部邊緣羽化半徑相對於唇部高度的比例，以及最小羽化半徑（像素）
+    FEATHER_RATIO = 0.05
+    FEATHER_MIN = 1.0
+    # 裁切渲染區域時在羽化範圍外額外保留的邊界（像素）
+    ROI_MARGIN = 8
+    # 質地紋理貼圖的隨機種子與固定邊長
+    TEXTURE_SEED = 2024
+    TEXTURE_TILE_SIZE = 512
+    # 絲絨顆粒的明暗幅度，紋理0-1對應亮度 ±VELVET_GRAIN/2
+    VELVET_GRAIN = 0.2
+    # 高光漸變圖快取的外框尺寸區間（像素）
+    HIGHLIGHT_BUCKET = 16
+    
+    def __init__(self, max_workers: int = 1, seed: Optional[int] = None):
+        """
+        初始化口紅渲染器
+        
+        Args:
+            max_workers: 多張臉並行處理時的執行緒數，1表示逐臉依序處理
+            seed: 質地紋理的隨機種子，None表示使用TEXTURE_SEED；
+                相同種子與輸入的渲染結果逐像素相同
+        """
+        self.max_workers = max(1, int(max_workers))
+        self.seed = self.TEXTURE_SEED if seed is None else int(seed)
+        # 執行緒池在首次處理多張臉時才建立；渲染器可能被多個執行緒共用，建立與關閉時需加鎖
+        self._executor = None
+        self._executor_lock = threading.Lock()
+    
+    def map_faces(self, func: Callable[[Any], Any], items: List[Any]) -> List[Any]:
+        """
+        對每張臉執行func，設定了多個執行緒且不只一張臉時在執行緒池中並行執行
+        
+        OpenCV與NumPy的運算會釋放GIL，各張臉的遮罩生成與渲染可以互相重疊
+        
+        Args:
+            func: 處理單張臉的函數，不可修改與其他臉共用的狀態
+            items: 各張臉的輸入，例如特徵點或唇部遮罩
+            
+        Returns:
+            與items順序相同的結果列表
+        """
+        items = list(items)
+        if self.max_workers <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="lipstick"
+                )
+            executor = self._executor
+        return list(executor.map(func, items))
+    
+    def close(self) -> None:
+        """關閉執行緒池"""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
     
     def apply_lipstick(
         self, 
         image: np.ndarray, 
-        mask: np.ndarray, 
+        mask: Union[np.ndarray, LipMask], 
         color_rgb: Tuple[int, int, int], 
         texture_type: str = "matte",
-        opacity: float = 0.7
+        opacity: float = 0.7,
+        precision: str = "float"
     ) -> np.ndarray:
         """
         將口紅效果應用到圖片上的唇部區域
         
         Args:
             image: 原始圖片
-            mask: 唇部遮罩
+            mask: 唇部遮罩，可為整張圖大小的遮罩或LipMask
             color_rgb: 口紅顏色的RGB值
             texture_type: 口紅質地，可選 "matte"（霧面）, "gloss"（珠光）, "velvet"（絲絨）
             opacity: 口紅不透明度/強度
+            precision: 運算精度，"float" 使用浮點運算，"fixed" 使用uint8定點運算（較快，適合視頻串流）
         
         Returns:
             應用了口紅效果的圖片
         """
+        results = self.apply_lipstick_batch(
+            image,
+            mask,
+            [(color_rgb, texture_type, opacity)],
+            precision=precision
+        )
+        return results[0]
+    
+    def apply_lipstick_batch(
+        self,
+        image: np.ndarray,
+        mask: Union[np.ndarray, LipMask],
+        specs: List[Tuple[Tuple[int, int, int], str, float]],
+        return_patches: bool = False,
+        precision: str = "float"
+    ) -> Union[List[np.ndarray], Tuple[List[np.ndarray], Optional[Tuple[int, int, int, int]]]]:
+        """
+        對同一張臉一次渲染多個色號
+        
+        唇部區域裁切、遮罩細化與共用的遮罩層只計算一次，之後每個色號只需在
+        唇部區域內混合顏色與質地
+        
+        Args:
+            image: 原始圖片
+            mask: 唇部遮罩，可為整張圖大小的遮罩或LipMask
+            specs: 色號列表，每項為 (color_rgb, texture_type, opacity)
+            return_patches: 為True時只返回唇部區域的圖塊，不貼回整張圖
+            precision: 運算精度，"float" 或 "fixed"
+        
+        Returns:
+            results: 與specs順序相同的整張圖片列表；
+                     return_patches為True時返回 (patches, bbox)，bbox為圖塊在原圖中的 (x, y, w, h)，
+                     遮罩為空時patches為空列表、bbox為None
+        """
         try:
             # 確保輸入圖像和遮罩的數據類型正確
             if image is None or mask is None:
-                return image
+                return ([], None) if return_patches else [image] * len(specs)
                 
-            image = image.astype(np.uint8)
+            image = np.asarray(image, dtype=np.uint8)
             
-            # 確保遮罩是合適的數據類型且不為空
-            if mask.size == 0:
-                return image
+            # 只渲染唇部外框加上邊界的區域，避免配置整張圖大小的浮點陣列
+            region = self._get_face_region(mask, image.shape[:2])
+            if region is None:
+                return ([], None) if return_patches else [image.copy() for _ in specs]
+            rows, cols, mask_roi = region
+            patches = self._render_region(image[rows, cols], mask_roi, specs, precision)
             
-            mask = mask.astype(np.uint8)
+            if return_patches:
+                bbox = (cols.start, rows.start, cols.stop - cols.start, rows.stop - rows.start)
+                return patches, bbox
             
-            # 創建圖像的副本以避免修改原始圖像
-            result = image.copy()
+            # 將渲染後的區域貼回原圖的副本
+            results = []
+            for patch in patches:
+                result = image.copy()
+                result[rows, cols] = patch
+                results.append(result)
             
-            # 優化色彩：調整色相和飽和度以增強口紅效果
-            color_hsv = cv2.cvtColor(np.uint8([[color_rgb]]), cv2.COLOR_RGB2HSV)[0][0]
+            return results
+        except Exception as e:
+            print(f"渲染口紅時發生錯誤: {str(e)}")
+            # 發生錯誤時返回原始圖像
+            return ([], None) if return_patches else [image] * len(specs)
+    
+    def apply_lipstick_faces(
+        self,
+        image: np.ndarray,
+        masks: List[Union[np.ndarray, LipMask]],
+        color_rgb: Tuple[int, int, int],
+        texture_type: str = "matte",
+        opacity: float = 0.7,
+        precision: str = "float",
+        out: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        在同一個輸出緩衝中為多張臉套用相同的口紅
+        
+        每張臉只在自己的唇部區域內渲染後寫回輸出，不需要逐臉複製整張圖，
+        也不需要再以遮罩合成；相鄰人臉的渲染區域重疊時會依序疊加。
+        設定了max_workers時，互不重疊的各張臉會在執行緒池中並行渲染
+        
+        Args:
+            image: 原始圖片
+            masks: 各張臉的唇部遮罩，可為整張圖大小的遮罩或LipMask，None會被略過
+            color_rgb: 口紅顏色的RGB值
+            texture_type: 口紅質地
+            opacity: 口紅不透明度/強度
+            precision: 運算精度，"float" 或 "fixed"
+            out: 可選的輸出緩衝，需為與image同尺寸的uint8陣列，可與image相同以原地渲染
+        
+        Returns:
+            應用了口紅效果的圖片（指定out時即為out）
+        """
+        try:
+            if image is None:
+                return image
             
-            # 根據色相調整飽和度，紅色系增強更多
-            h, s, v = color_hsv
-            if 0 <= h <= 20 or 160 <= h <= 180:  # 紅色系
-                s = min(255, int(s * 1.3))  # 增強紅色系飽和度
+            # 唯一一次整張圖的複製，作為所有人臉共用的輸出緩衝
+            if out is None:
+                result = image.astype(np.uint8)
             else:
-                s = min(255, int(s * 1.2))  # 其他顏色稍微增強飽和度
-                
-            # 提高明度，使顏色更鮮明
-            v = min(255, int(v * 1.1))
-                
-            # 更新HSV值
-            color_hsv = np.array([h, s, v], dtype=np.uint8)
-            
-            # 轉回RGB
-            enhanced_color = cv2.cvtColor(np.uint8([[color_hsv]]), cv2.COLOR_HSV2RGB)[0][0]
-            
-            # 轉換為BGR以匹配OpenCV的格式
-            color_bgr = (enhanced_color[2], enhanced_color[1], enhanced_color[0])
-            
-            # 進行唇部邊緣細化處理
-            refined_mask = self._refine_mask(mask)
-            
-            # 將遮罩擴展為3通道
-            mask_3channel = cv2.cvtColor(refined_mask, cv2.COLOR_GRAY2BGR)
-            mask_3channel = mask_3channel.astype(np.float32) / 255.0
+                result = out
+                if result is not image:
+                    np.copyto(result, image)
+            specs = [(color_rgb, texture_type, opacity)]
             
-            # 計算加強後的不透明度，確保效果更加明顯
-            enhanced_opacity = min(1.0, opacity * 1.2)  # 增強不透明度但不超過1.0
-            
-            # 創建與輸入圖像相同大小的顏色層
-            color_layer = np.zeros_like(result, dtype=np.float32)
-            color_layer[:] = color_bgr
+            frame_shape = result.shape[:2]
+            regions = self.map_faces(
+                lambda mask: None if mask is None else self._get_face_region(mask, frame_shape),
+                masks
+            )
+            regions = [region for region in regions if region is not None]
             
-            # 根據質地類型應用不同的效果
-            if texture_type == "matte":
-                result_float = self.apply_matte_effect(
-                    result.astype(np.float32),
-                    color_layer,
-                    mask_3channel,
-                    enhanced_opacity
-                )
-            elif texture_type == "gloss":
-                result_float = self.apply_gloss_effect(
-                    result.astype(np.float32),
-                    color_layer,
-                    mask_3channel,
-                    enhanced_opacity
-                )
-            elif texture_type == "velvet":
-                result_float = self.apply_velvet_effect(
-                    result.astype(np.float32),
-                    color_layer,
-                    mask_3channel,
-                    enhanced_opacity
+            if len(regions) > 1 and self.max_workers > 1 and not self._regions_overlap(regions):
+                # 各張臉的區域互不重疊：並行渲染後再依序寫回輸出
+                patches = self.map_faces(
+                    lambda region: self._render_region(
+                        result[region[0], region[1]], region[2], specs, precision
+                    )[0],
+                    regions
                 )
+                for (rows, cols, _), patch in zip(regions, patches):
+                    result[rows, cols] = patch
             else:
-                # 默認為霧面效果
-                result_float = self.apply_matte_effect(
-                    result.astype(np.float32),
-                    color_layer,
-                    mask_3channel,
-                    enhanced_opacity
-                )
-            
-            # 確保結果在有效範圍內並轉換回uint8
-            result = np.clip(result_float, 0, 255).astype(np.uint8)
-            
-            # 進行最終的唇部混合優化
-            result = self._blend_lips_with_skin(image, result, refined_mask)
+                for rows, cols, mask_roi in regions:
+                    # 從輸出緩衝讀取，使重疊區域保留先前人臉的渲染結果
+                    result[rows, cols] = self._render_region(
+                        result[rows, cols], mask_roi, specs, precision
+                    )[0]
             
             return result
         except Exception as e:
@@ -125,79 +290,379 @@ class LipstickRenderer:
             # 發生錯誤時返回原始圖像
             return image
     
-    def _refine_mask(self, mask: np.ndarray) -> np.ndarray:
+    @staticmethod
+    def _regions_overlap(regions: List[Tuple[slice, slice, np.ndarray]]) -> bool:
         """
-        細化唇部遮罩，創建更自然的邊緣過渡
+        檢查各張臉的渲染區域是否有重疊
         
         Args:
-            mask: 原始唇部遮罩
+            regions: _get_face_region返回的區域列表
             
         Returns:
-            refined_mask: 細化後的遮罩
+            是否有任兩個區域重疊
         """
-        # 獲取遮罩尺寸
-        h, w = mask.shape[:2]
+        for i, (rows_a, cols_a, _) in enumerate(regions):
+            for rows_b, cols_b, _ in regions[i + 1:]:
+                if (rows_a.start < rows_b.stop and rows_b.start < rows_a.stop
+                        and cols_a.start < cols_b.stop and cols_b.start < cols_a.stop):
+                    return True
+        return False
+    
+    def _render_region(
+        self,
+        image: np.ndarray,
+        mask: np.ndarray,
+        specs: List[Tuple[Tuple[int, int, int], str, float]],
+        precision: str
+    ) -> List[np.ndarray]:
+        """
+        在單張臉的渲染區域內渲染一個或多個色號
         
-        # 先進行高斯模糊使邊緣變柔和
-        blurred = cv2.GaussianBlur(mask, (7, 7), 0)
+        Args:
+            image: 渲染區域的uint8圖像
+            mask: 渲染區域的單通道uint8唇部遮罩
+            specs: 色號列表，每項為 (color_rgb, texture_type, opacity)
+            precision: 運算精度，"float" 或 "fixed"
+            
+        Returns:
+            patches: 與specs順序相同的渲染結果
+        """
+        # 羽化遮罩與共用圖層只計算一次，所有色號共用
+        layers = self._prepare_layers(image, mask, precision)
+        render = self._render_fixed_point if precision == "fixed" else self._render_float
         
-        # 應用平均濾波器進一步平滑
-        kernel_size = max(3, min(h, w) // 50)  # 根據圖像大小調整核大小
-        kernel_size = kernel_size if kernel_size % 2 == 1 else kernel_size + 1  # 確保是奇數
-        smoothed = cv2.blur(blurred, (kernel_size, kernel_size))
+        patches = []
+        for color_rgb, texture_type, opacity in specs:
+            color_bgr = self._enhance_color(color_rgb)
+            
+            # 計算加強後的不透明度，確保效果更加明顯
+            enhanced_opacity = min(1.0, opacity * 1.2)  # 增強不透明度但不超過1.0
+            
+            patches.append(render(image, layers, color_bgr, texture_type, enhanced_opacity))
         
-        # 確保遮罩中心保持實心
-        _, binary_mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)
+        return patches
+    
+    def _enhance_color(self, color_rgb: Tuple[int, int, int]) -> Tuple[int, int, int]:
+        """
+        調整色號的飽和度與明度，增強口紅效果
         
-        # 創建漸變邊緣
-        edge_mask = cv2.bitwise_xor(
-            binary_mask,
-            cv2.erode(binary_mask, None, iterations=2)
-        )
+        色號庫中的顏色直接讀取預先編譯的色號表，其他顏色才即時計算
+        
+        Args:
+            color_rgb: 口紅顏色的RGB值
+            
+        Returns:
+            color_bgr: 增強後的BGR顏色
+        """
+        return get_enhanced_bgr(color_rgb)
+    
+    def _prepare_layers(self, image: np.ndarray, mask: np.ndarray, precision: str) -> dict:
+        """
+        預先計算與色號無關的共用圖層
+        
+        Args:
+            image: 唇部區域的uint8圖像
+            mask: 唇部區域的單通道uint8遮罩
+            precision: 運算精度，"float" 或 "fixed"
+            
+        Returns:
+            layers: 共用圖層字典，alpha為唯一的單通道羽化遮罩
+        """
+        alpha = self._compute_alpha_matte(mask)
+        if precision == "fixed":
+            return {"alpha": cv2.convertScaleAbs(alpha, alpha=255.0)}
+        
+        return {
+            "image_float": image.astype(np.float32),
+            "alpha": alpha[:, :, np.newaxis]
+        }
+    
+    def _render_float(
+        self,
+        image: np.ndarray,
+        layers: dict,
+        color_bgr: Tuple[int, int, int],
+        texture_type: str,
+        opacity: float
+    ) -> np.ndarray:
+        """
+        以浮點運算渲染唇部區域
         
-        # 將漸變邊緣與原始遮罩結合
-        inner_mask = cv2.erode(binary_mask, None, iterations=2)
-        gradient_edge = cv2.addWeighted(
-            cv2.bitwise_and(edge_mask, smoothed),
-            0.7,
-            cv2.bitwise_and(edge_mask, blurred),
-            0.3,
-            0
+        Args:
+            image: 唇部區域的uint8圖像
+            layers: _prepare_layers預先計算的共用圖層
+            color_bgr: 增強後的口紅顏色 (BGR)
+            texture_type: 口紅質地
+            opacity: 加強後的不透明度
+            
+        Returns:
+            result: 渲染後的uint8圖像
+        """
+        # 創建與裁切區域相同大小的顏色層
+        color_layer = np.zeros_like(image, dtype=np.float32)
+        color_layer[:] = color_bgr
+        
+        # 根據質地類型應用不同的效果
+        if texture_type == "gloss":
+            effect = self.apply_gloss_effect
+        elif texture_type == "velvet":
+            effect = self.apply_velvet_effect
+        else:
+            # 默認為霧面效果
+            effect = self.apply_matte_effect
+        
+        # 質地效果直接以羽化遮罩與原圖合成，不需要再次融合
+        result_float = effect(
+            layers["image_float"],
+            color_layer,
+            layers["alpha"],
+            opacity
         )
         
-        # 組合內部和邊緣
-        refined_mask = cv2.bitwise_or(inner_mask, gradient_edge)
+        # 確保結果在有效範圍內並轉換回uint8
+        return np.clip(result_float, 0, 255).astype(np.uint8)
+    
+    def _render_fixed_point(
+        self,
+        image: np.ndarray,
+        layers: dict,
+        color_bgr: Tuple[int, int, int],
+        texture_type: str,
+        opacity: float
+    ) -> np.ndarray:
+        """
+        以uint8定點運算渲染唇部區域，所有混合都使用單通道的8位元alpha
+        
+        與浮點路徑的差異在一個灰階左右：霧面的細微噪點（標準差約0.1）
+        低於uint8的精度而被省略
         
-        return refined_mask
+        Args:
+            image: 唇部區域的uint8圖像
+            layers: _prepare_layers預先計算的共用圖層
+            color_bgr: 增強後的口紅顏色 (BGR)
+            texture_type: 口紅質地
+            opacity: 加強後的不透明度
+            
+        Returns:
+            result: 渲染後的uint8圖像
+        """
+        mask = layers["alpha"]
+        
+        if texture_type == "gloss":
+            alpha = cv2.convertScaleAbs(mask, alpha=opacity)
+            blended = self._blend_u8(image, color_bgr, alpha)
+            
+            # 高光強度隨顏色亮度調整，與浮點路徑相同
+            color_brightness = float(np.mean(color_bgr))
+            highlight_strength = 0.35 - (color_brightness / 255.0) * 0.15
+            highlight = self._get_highlight_map(mask) * mask
+            highlight_alpha = cv2.convertScaleAbs(highlight, alpha=highlight_strength)
+            final = self._blend_u8(blended, (255, 255, 255), highlight_alpha)
+            
+            # 在唇部範圍內輕微模糊
+            blurred_lips = cv2.GaussianBlur(final, (3, 3), 0)
+            return self._blend_u8(final, blurred_lips, mask)
+        elif texture_type == "velvet":
+            deepened_color = tuple(int(round(c * 0.85)) for c in color_bgr)
+            alpha = cv2.convertScaleAbs(mask, alpha=min(1.0, opacity * 1.2))
+            final = self._blend_u8(image, deepened_color, alpha)
+            
+            # 絲絨顆粒：單通道的明暗增益，與浮點路徑相同
+            h, w = mask.shape[:2]
+            texture = self._get_texture("velvet", h, w)
+            # 增益維持float32並直接廣播到三個通道，避免float64與三通道合併的開銷
+            gain = mask.astype(np.float32) * np.float32(self.VELVET_GRAIN / 255.0)
+            gain *= texture - np.float32(0.5)
+            gain += np.float32(1.0)
+            # convertScaleAbs四捨五入並飽和為uint8（增益恆為正，取絕對值無影響）
+            final = cv2.convertScaleAbs(final * gain[:, :, np.newaxis])
+            
+            blurred_lips = cv2.GaussianBlur(final, (3, 3), 0)
+            softened = cv2.addWeighted(final, 0.6, blurred_lips, 0.4, 0)
+            return self._blend_u8(image, softened, mask)
+        else:
+            alpha = cv2.convertScaleAbs(mask, alpha=opacity)
+            return self._blend_u8(image, color_bgr, alpha)
     
-    def _blend_lips_with_skin(
-        self, 
-        original: np.ndarray, 
-        lipstick: np.ndarray, 
-        mask: np.ndarray
+    @staticmethod
+    def _blend_u8(
+        base: np.ndarray,
+        overlay: Union[np.ndarray, Tuple[int, int, int]],
+        alpha: np.ndarray
     ) -> np.ndarray:
         """
-        將口紅效果與皮膚自然融合
+        以OpenCV的uint8核心進行alpha混合: base * (255 - alpha) / 255 + overlay * alpha / 255
         
         Args:
-            original: 原始圖像
-            lipstick: 應用了口紅的圖像
-            mask: 唇部遮罩
+            base: uint8圖像
+            overlay: 與base同尺寸的uint8圖像或單一顏色
+            alpha: 單通道uint8 alpha (0-255)
             
         Returns:
-            blended: 融合後的圖像
+            blended: 混合後的uint8圖像
+        """
+        if not isinstance(overlay, np.ndarray):
+            # 以填滿的矩形建立純色圖層，比numpy的廣播賦值快得多
+            color = tuple(int(c) for c in overlay)
+            overlay = np.empty_like(base)
+            cv2.rectangle(overlay, (0, 0), (base.shape[1], base.shape[0]), color, -1)
+        
+        # blendLinear只需單通道權重，直接在uint8圖像上混合，不產生寬型別的副本
+        weight = alpha.astype(np.float32)
+        weight *= np.float32(1.0 / 255.0)
+        return cv2.blendLinear(overlay, base, weight, 1.0 - weight)
+    
+    def _get_feather_radius(self, lip_height: int) -> float:
         """
-        # 創建模糊的遮罩邊緣
-        mask_blur = cv2.GaussianBlur(mask, (15, 15), 0)
+        根據唇部高度計算邊緣羽化半徑
         
-        # 使用Alpha混合實現柔和過渡
-        mask_norm = mask_blur.astype(np.float32) / 255.0
-        mask_3ch = cv2.merge([mask_norm, mask_norm, mask_norm])
+        Args:
+            lip_height: 唇部外框高度（像素）
+            
+        Returns:
+            feather: 羽化半徑（像素）
+        """
+        return max(self.FEATHER_MIN, lip_height * self.FEATHER_RATIO)
+    
+    def _get_face_region(
+        self,
+        mask: Union[np.ndarray, LipMask],
+        frame_shape: Tuple[int, int]
+    ) -> Optional[Tuple[slice, slice, np.ndarray]]:
+        """
+        計算單張臉需要渲染的區域：遮罩非零區域的外框，加上羽化與模糊濾波的影響範圍
+        
+        Args:
+            mask: 整張圖大小的唇部遮罩，或LipMask唇部遮罩
+            frame_shape: 原始圖像的(高, 寬)
+            
+        Returns:
+            region: (rows, cols, mask_roi)，mask_roi為區域內的唇部遮罩，遮罩為空時返回None
+        """
+        if isinstance(mask, LipMask):
+            patch = np.asarray(mask.patch, dtype=np.uint8)
+            px, py, w, h = cv2.boundingRect(patch)
+            x, y = mask.x + px, mask.y + py
+        else:
+            mask = np.asarray(mask, dtype=np.uint8)
+            if mask.size == 0:
+                return None
+            x, y, w, h = cv2.boundingRect(mask)
+        if w == 0 or h == 0:
+            return None
+        
+        # 邊界需涵蓋羽化向外延伸的範圍與質地的模糊半徑，使裁切邊緣不影響結果
+        frame_h, frame_w = frame_shape[:2]
+        pad = int(np.ceil(self._get_feather_radius(h))) + self.ROI_MARGIN
+        
+        x0 = max(0, x - pad)
+        y0 = max(0, y - pad)
+        x1 = min(frame_w, x + w + pad)
+        y1 = min(frame_h, y + h + pad)
+        rows, cols = slice(y0, y1), slice(x0, x1)
+        
+        if not isinstance(mask, LipMask):
+            return rows, cols, mask[rows, cols]
+        
+        # 將LipMask的小型遮罩放入渲染區域，只複製兩者重疊的部分
+        mask_roi = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        patch_h, patch_w = patch.shape[:2]
+        iy0, iy1 = max(y0, mask.y), min(y1, mask.y + patch_h)
+        ix0, ix1 = max(x0, mask.x), min(x1, mask.x + patch_w)
+        mask_roi[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0] = patch[iy0 - mask.y:iy1 - mask.y, ix0 - mask.x:ix1 - mask.x]
+        return rows, cols, mask_roi
+    
+    def _compute_alpha_matte(self, mask: np.ndarray) -> np.ndarray:
+        """
+        以距離轉換一次算出唇部的羽化遮罩
+        
+        以唇部輪廓為中心計算有號距離，輪廓內外各羽化一個半徑，並以smoothstep
+        產生平滑過渡。唇部內部維持完全不透明，邊緣柔和地融入皮膚
+        
+        Args:
+            mask: 單通道uint8唇部遮罩
+            
+        Returns:
+            alpha: 與遮罩同尺寸的float32羽化遮罩（0-1）
+        """
+        binary = (mask >= 128).astype(np.uint8)
+        x, y, w, h = cv2.boundingRect(binary)
+        if w == 0 or h == 0:
+            return np.zeros(mask.shape[:2], dtype=np.float32)
+        feather = self._get_feather_radius(h)
+        
+        # 輪廓內為正、輪廓外為負的距離，以像素中心到輪廓的距離計
+        inside = cv2.distanceTransform(binary, cv2.DIST_L2, 3)
+        outside = cv2.distanceTransform(1 - binary, cv2.DIST_L2, 3)
+        signed = np.where(binary > 0, inside - 0.5, 0.5 - outside)
+        
+        # 輪廓上的抗鋸齒像素以覆蓋率換算次像素距離，避免羽化邊緣出現鋸齒
+        edge = (mask > 0) & (mask < 255)
+        signed[edge] = mask[edge] / 255.0 - 0.5
+        
+        t = np.clip((signed + feather) / (2.0 * feather), 0.0, 1.0)
+        return (t * t * (3.0 - 2.0 * t)).astype(np.float32)
+    
+    def _get_texture(self, texture_type: str, h: int, w: int) -> np.ndarray:
+        """
+        取得以唇部區域左上角為原點的紋理
         
-        # 應用混合
-        blended = original.astype(np.float32) * (1.0 - mask_3ch) + lipstick.astype(np.float32) * mask_3ch
+        每種質地與種子只有一張固定邊長的貼圖，所有區域大小都從同一張貼圖
+        裁切或平鋪，唇部在視頻中放大縮小時紋理圖案保持不變
         
-        return blended.astype(np.uint8)
+        Args:
+            texture_type: 質地類型，"matte" 或 "velvet"
+            h: 區域高度
+            w: 區域寬度
+            
+        Returns:
+            texture: (h, w)或(h, w, 3)的紋理
+        """
+        size = self.TEXTURE_TILE_SIZE
+        tile = _texture_tile(texture_type, size, self.seed)
+        
+        # 超過貼圖尺寸時重複平鋪
+        if h > size or w > size:
+            reps = (-(-h // size), -(-w // size)) + (1,) * (tile.ndim - 2)
+            tile = np.tile(tile, reps)
+        return tile[:h, :w]
+    
+    def _get_highlight_map(self, mask: np.ndarray) -> np.ndarray:
+        """
+        產生對齊唇部的徑向高光漸變
+        
+        高光中心位於唇部外框水平中央、上方40%處，半徑與外框大小成比例。
+        漸變圖依外框尺寸區間快取，為外框的兩倍大，依中心位置切出所需區域
+        
+        Args:
+            mask: 單通道的唇部遮罩（0-1）
+            
+        Returns:
+            highlight: 與遮罩同尺寸的高光漸變（0-1）
+        """
+        h, w = mask.shape[:2]
+        x, y, bw, bh = cv2.boundingRect((mask > 0).astype(np.uint8))
+        if bw == 0 or bh == 0:
+            return np.zeros((h, w), dtype=np.float32)
+        
+        # 外框尺寸取整到區間，使相近大小的唇部共用同一張漸變圖
+        bucket = self.HIGHLIGHT_BUCKET
+        bucket_h = -(-bh // bucket) * bucket
+        bucket_w = -(-bw // bucket) * bucket
+        gradient = _highlight_gradient(bucket_h, bucket_w)
+        
+        # 漸變圖中心 (bucket_h, bucket_w) 對齊到唇部高光中心
+        center_y = y + int(bh * 0.4)
+        center_x = x + int(bw * 0.5)
+        top = bucket_h - center_y
+        left = bucket_w - center_x
+        
+        highlight = np.zeros((h, w), dtype=np.float32)
+        y0, y1 = max(0, -top), min(h, 2 * bucket_h - top)
+        x0, x1 = max(0, -left), min(w, 2 * bucket_w - left)
+        if y1 > y0 and x1 > x0:
+            highlight[y0:y1, x0:x1] = gradient[y0 + top:y1 + top, x0 + left:x1 + left]
+        return highlight
     
     def apply_matte_effect(
         self, 
@@ -218,7 +683,7 @@ class LipstickRenderer:
         blended = image * (1 - mask * opacity) + color_layer * (mask * opacity)
         
         # 應用輕微的紋理以增強霧面感
-        noise = np.random.normal(0, 2.0, image.shape).astype(np.float32)
+        noise = self._get_texture("matte", image.shape[0], image.shape[1])
         noise_mask = noise * mask * 0.05  # 輕微噪點
         
         # 將噪點應用到混合結果
@@ -243,50 +708,23 @@ class LipstickRenderer:
         # 首先應用基本的顏色
         blended = image * (1 - mask * opacity) + color_layer * (mask * opacity)
         
-        # 創建高光效果
-        # 先定義高光區域（唇部中央偏上區域）
-        highlight_mask = np.zeros_like(mask)
-        h, w, _ = mask.shape
-        
-        # 創建徑向漸變作為高光（從中心向外漸變）
-        y, x = np.ogrid[:h, :w]
-        center_y, center_x = int(h * 0.4), int(w * 0.5)  # 稍微上移中心點
-        
-        # 計算到中心的距離
-        dist_from_center = np.sqrt((x - center_x)**2 + (y - center_y)**2)
-        
-        # 創建徑向漸變
-        max_dist = np.sqrt(h**2 + w**2) * 0.3  # 控制高光大小
-        highlight_gradient = np.clip(1 - dist_from_center / max_dist, 0, 1)
-        
-        # 應用到遮罩
-        for c in range(3):
-            highlight_mask[:, :, c] = highlight_gradient
+        # 創建高光效果：以唇部外框為基準，高光位於唇部中央偏上區域
+        highlight_gradient = self._get_highlight_map(mask[:, :, 0])
         
         # 只在唇部區域內應用高光
-        highlight_mask = highlight_mask * mask
+        highlight_mask = highlight_gradient[:, :, np.newaxis] * mask
         
         # 創建動態高光強度 - 較亮的顏色使用較低的高光強度
         color_brightness = np.mean(color_layer)
         highlight_strength = 0.35 - (color_brightness / 255.0) * 0.15  # 0.2 到 0.35 範圍
         
-        # 創建高光層（白色）
-        highlight_layer = np.ones_like(image) * 255
-        
-        # 將高光混合到已著色的唇部
-        final = blended * (1 - highlight_mask * highlight_strength) + highlight_layer * (highlight_mask * highlight_strength)
+        # 將白色高光混合到已著色的唇部
+        final = blended * (1 - highlight_mask * highlight_strength) + 255.0 * (highlight_mask * highlight_strength)
         
         # 減少可能的雜訊
-        # 對唇部應用輕微的高斯模糊（只在唇部區域）
-        lips_only = np.zeros_like(image)
-        lips_only = np.where(mask > 0.1, final, lips_only)
-        
-        # 對唇部進行輕微模糊
-        blurred_lips = cv2.GaussianBlur(lips_only, (3, 3), 0)
-        
-        # 使用原始遮罩將模糊唇部與原始圖像合成
-        mask_for_blur = np.where(mask > 0.1, 1.0, 0.0).astype(np.float32)
-        result = image * (1 - mask_for_blur) + blurred_lips * mask_for_blur
+        # 對唇部進行輕微模糊，並以羽化遮罩限制在唇部範圍內
+        blurred_lips = cv2.GaussianBlur(final, (3, 3), 0)
+        result = final + (blurred_lips - final) * mask
         
         return result
     
@@ -314,45 +752,22 @@ class LipstickRenderer:
         # 添加細緻的絲絨質感 - 使用更微妙的紋理
         h, w, _ = mask.shape
         
-        # 創建較為均勻細緻的紋理效果 - 絲絨的細微顆粒感
-        texture = np.zeros((h, w), dtype=np.float32)
-        
-        # 使用更小的噪聲比例以創建更細緻的質感
-        for scale in [2, 5, 10]:  # 更細緻的紋理比例
-            noise = np.random.normal(0, 1, (h//scale+1, w//scale+1)).astype(np.float32)
-            noise = cv2.resize(noise, (w, h))
-            texture += noise * (scale / 30.0)  # 更低的噪聲強度
-        
-        # 使紋理更加均勻和細緻
-        texture = cv2.GaussianBlur(texture, (3, 3), 0)
-        texture = (texture - texture.min()) / (texture.max() - texture.min() + 1e-8)
-        texture = texture * 0.09  # 微妙但可察覺的紋理效果
-        
-        # 將紋理轉換為3通道
-        texture_3channel = np.zeros_like(blended)
-        for c in range(3):
-            texture_3channel[:, :, c] = texture
-        
-        # 只在唇部區域應用紋理
-        texture_mask = texture_3channel * mask * 0.15
+        # 絲絨的細微顆粒感 - 使用快取的多比例紋理貼圖
+        texture = self._get_texture("velvet", h, w)[:, :, np.newaxis]
         
         # 絲絨效果特點: 啞光但有細膩質感，不平也不亮
-        # 絲絨的微妙變化 - 小區域的明暗變化
-        final = blended * (1.0 - texture_mask) + blended * (1.06 + texture_mask)
+        # 依紋理在唇部範圍內微調明暗，紋理0.5處亮度不變
+        final = blended * (1.0 + (texture - 0.5) * (self.VELVET_GRAIN * mask))
         
         # 輕微模糊唇部以創造柔和效果 - 絲絨的柔和感
-        lips_only = np.zeros_like(final)
-        lips_only = np.where(mask > 0.1, final, lips_only)
-        
         # 非常輕微的模糊，僅足以消除紋理的尖銳邊緣
-        blurred_lips = cv2.GaussianBlur(lips_only, (3, 3), 0)
+        blurred_lips = cv2.GaussianBlur(final, (3, 3), 0)
         
         # 使模糊效果更加細微，保持一些質感 - 絲絨質感既柔和又有質感
-        result = lips_only * 0.6 + blurred_lips * 0.4
+        result = final * 0.6 + blurred_lips * 0.4
         
-        # 最終混合回原圖
-        mask_for_result = np.where(mask > 0.1, 1.0, 0.0).astype(np.float32)
-        result = image * (1 - mask_for_result) + result * mask_for_result
+        # 以羽化遮罩混合回原圖
+        result = image * (1 - mask) + result * mask
         
         # 裁剪到有效範圍
         result = np.clip(result, 0, 255)
@@ -1,5 +1,3 @@
-import numpy as np
-
 class LipstickRecommender:
     """口紅色彩推薦系統，基於膚色HSV值推薦適合的口紅色號"""
     
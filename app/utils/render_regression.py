@@ -0,0 +1,338 @@
+"""口紅渲染的黃金圖像回歸測試
+
+以儲存的唇部特徵點夾具生成遮罩，在固定種子的合成膚色圖上渲染每種質地與
+運算精度，與儲存的黃金輸出比較PSNR/SSIM，並與記錄的基準耗時比較加速比。
+修改渲染器的效能後執行一次即可確認畫面是否偏移、速度是否提升：
+
+    python -m app.utils.render_regression            # 比較並回報
+    python -m app.utils.render_regression --update   # 以目前的渲染結果更新黃金輸出與基準耗時
+    python -m app.utils.render_regression --capture photo.jpg --name my_face
+                                                      # 從照片擷取新的特徵點夾具
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from app.utils.lip_mask import rasterize_lip_mask
+from app.utils.lipstick_renderer import LipstickRenderer
+
+ASSET_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "assets", "render_regression")
+FIXTURES_FILE = "fixtures.json"
+GOLDEN_DIR = "golden"
+TIMINGS_FILE = "timings.json"
+
+TEXTURES = ("matte", "gloss", "velvet")
+PRECISIONS = ("float", "fixed")
+
+# 合成底圖的隨機種子與膚色 (BGR)
+FRAME_SEED = 7
+SKIN_BGR = (150, 175, 215)
+
+
+def psnr(reference, image, max_value=255.0):
+    """計算兩張圖像的峰值信噪比 (PSNR)
+
+    Args:
+        reference: 參考圖像
+        image: 要比較的圖像，尺寸需與參考圖像相同
+        max_value: 像素的最大值
+
+    Returns:
+        psnr: 峰值信噪比 (dB)，兩張圖像完全相同時返回inf
+    """
+    diff = reference.astype(np.float64) - image.astype(np.float64)
+    mse = float(np.mean(diff * diff))
+    if mse == 0:
+        return float("inf")
+    return 10.0 * np.log10(max_value * max_value / mse)
+
+
+def ssim(reference, image, max_value=255.0):
+    """計算兩張圖像的結構相似度 (SSIM)
+
+    以11x11、sigma=1.5的高斯窗計算局部統計量，彩色圖像取各通道的平均
+
+    Args:
+        reference: 參考圖像
+        image: 要比較的圖像，尺寸需與參考圖像相同
+        max_value: 像素的最大值
+
+    Returns:
+        ssim: 結構相似度 (-1到1)，兩張圖像完全相同時為1
+    """
+    c1 = (0.01 * max_value) ** 2
+    c2 = (0.03 * max_value) ** 2
+    x = reference.astype(np.float64)
+    y = image.astype(np.float64)
+
+    def blur(values):
+        return cv2.GaussianBlur(values, (11, 11), 1.5)
+
+    mu_x = blur(x)
+    mu_y = blur(y)
+    mu_xx = mu_x * mu_x
+    mu_yy = mu_y * mu_y
+    mu_xy = mu_x * mu_y
+    var_x = blur(x * x) - mu_xx
+    var_y = blur(y * y) - mu_yy
+    cov_xy = blur(x * y) - mu_xy
+
+    ssim_map = ((2 * mu_xy + c1) * (2 * cov_xy + c2)) / (
+        (mu_xx + mu_yy + c1) * (var_x + var_y + c2)
+    )
+    return float(ssim_map.mean())
+
+
+def load_fixtures(asset_dir=ASSET_DIR):
+    """讀取唇部特徵點夾具
+
+    Args:
+        asset_dir: 夾具與黃金輸出所在的目錄
+
+    Returns:
+        fixtures: 夾具列表，每項包含 name, frame_shape, outer, inner, mouth_closed,
+            color_rgb, opacity
+    """
+    with open(os.path.join(asset_dir, FIXTURES_FILE), encoding="utf-8") as f:
+        fixtures = json.load(f)
+    for fixture in fixtures:
+        fixture["outer"] = np.asarray(fixture["outer"], dtype=np.float32)
+        fixture["inner"] = np.asarray(fixture["inner"], dtype=np.float32)
+    return fixtures
+
+
+def make_frame(frame_shape, seed=FRAME_SEED):
+    """生成固定種子的合成膚色底圖
+
+    底圖帶有平滑的明暗漸變與低頻雜訊，讓紋理、高光與邊緣羽化都有可比較的細節
+
+    Args:
+        frame_shape: 圖像的(高, 寬)
+        seed: 隨機種子
+
+    Returns:
+        frame: BGR uint8圖像
+    """
+    height, width = frame_shape[:2]
+    rng = np.random.default_rng(seed)
+    ys = np.linspace(-0.5, 0.5, height, dtype=np.float32)[:, None]
+    xs = np.linspace(-0.5, 0.5, width, dtype=np.float32)[None, :]
+    shading = 1.0 - 0.35 * (xs * xs + ys * ys)
+    noise = cv2.GaussianBlur(rng.standard_normal((height, width)).astype(np.float32), (0, 0), 2.0)
+    frame = np.array(SKIN_BGR, dtype=np.float32) * (shading + 0.08 * noise)[:, :, None]
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def fixture_mask(fixture):
+    """以夾具的唇部輪廓生成唇部遮罩
+
+    Returns:
+        lip_mask: LipMask唇部遮罩
+    """
+    return rasterize_lip_mask(
+        fixture["outer"], fixture["inner"], fixture["frame_shape"], fixture["mouth_closed"]
+    )
+
+
+def golden_path(asset_dir, fixture_name, texture_type, precision):
+    """黃金輸出（渲染區域裁切圖）的檔案路徑"""
+    return os.path.join(asset_dir, GOLDEN_DIR, f"{fixture_name}_{texture_type}_{precision}.png")
+
+
+def render_case(renderer, frame, mask, fixture, texture_type, precision, repeat):
+    """渲染一個案例並計時
+
+    Args:
+        renderer: LipstickRenderer
+        frame: 合成底圖
+        mask: 唇部遮罩
+        fixture: 夾具
+        texture_type: 口紅質地
+        precision: 運算精度
+        repeat: 計時重複次數
+
+    Returns:
+        patch: 渲染區域的裁切圖
+        elapsed_ms: 渲染耗時的中位數（毫秒）
+    """
+    specs = [(tuple(fixture["color_rgb"]), texture_type, fixture["opacity"])]
+    # 預熱一次，讓紋理與高光快取不計入耗時
+    patches, _ = renderer.apply_lipstick_batch(frame, mask, specs, return_patches=True, precision=precision)
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        renderer.apply_lipstick_batch(frame, mask, specs, return_patches=True, precision=precision)
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return patches[0], float(np.median(timings))
+
+
+def run(asset_dir=ASSET_DIR, update=False, repeat=20, seed=None, min_psnr=40.0, min_ssim=0.98,
+        min_fixed_psnr=45.0):
+    """執行所有夾具、質地與精度的回歸比較
+
+    除了與黃金輸出比較外，定點運算的結果也會與同一次執行的浮點結果比較
+
+    Args:
+        asset_dir: 夾具與黃金輸出所在的目錄
+        update: 是否以目前的渲染結果覆寫黃金輸出與基準耗時
+        repeat: 每個案例的計時重複次數
+        seed: 渲染器的紋理種子，None表示使用預設種子
+        min_psnr: PSNR低於此值（dB）時視為畫面偏移
+        min_ssim: SSIM低於此值時視為畫面偏移
+        min_fixed_psnr: 定點結果相對浮點結果的PSNR低於此值（dB）時視為失敗
+
+    Returns:
+        results: 每個案例的結果字典列表
+    """
+    renderer = LipstickRenderer(seed=seed)
+    timings_path = os.path.join(asset_dir, GOLDEN_DIR, TIMINGS_FILE)
+    baseline = {}
+    if not update and os.path.exists(timings_path):
+        with open(timings_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = []
+    for fixture in load_fixtures(asset_dir):
+        frame = make_frame(fixture["frame_shape"])
+        mask = fixture_mask(fixture)
+        for texture_type in TEXTURES:
+            patches = {}
+            for precision in PRECISIONS:
+                key = f"{fixture['name']}_{texture_type}_{precision}"
+                patch, elapsed_ms = render_case(
+                    renderer, frame, mask, fixture, texture_type, precision, repeat
+                )
+                patches[precision] = patch
+                result = {"case": key, "ms": elapsed_ms, "psnr": None, "ssim": None,
+                          "speedup": None, "fixed_psnr": None, "passed": True}
+
+                path = golden_path(asset_dir, fixture["name"], texture_type, precision)
+                if update:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    cv2.imwrite(path, patch)
+                else:
+                    golden = cv2.imread(path, cv2.IMREAD_COLOR)
+                    if golden is None or golden.shape != patch.shape:
+                        # 缺少黃金輸出或渲染區域大小改變
+                        result["passed"] = False
+                    else:
+                        result["psnr"] = psnr(golden, patch)
+                        result["ssim"] = ssim(golden, patch)
+                        result["passed"] = result["psnr"] >= min_psnr and result["ssim"] >= min_ssim
+                    if key in baseline and elapsed_ms > 0:
+                        result["speedup"] = baseline[key] / elapsed_ms
+
+                if precision == "fixed" and "float" in patches:
+                    # 定點路徑與浮點路徑的差異需在可接受範圍內
+                    result["fixed_psnr"] = psnr(patches["float"], patch)
+                    if result["fixed_psnr"] < min_fixed_psnr:
+                        result["passed"] = False
+                results.append(result)
+
+    if update:
+        with open(timings_path, "w", encoding="utf-8") as f:
+            json.dump({r["case"]: round(r["ms"], 3) for r in results}, f, indent=2)
+    return results
+
+
+def format_results(results):
+    """將結果整理為文字表格"""
+    lines = [f"{'案例':<28}{'耗時(ms)':>10}{'加速比':>8}{'PSNR(dB)':>10}{'SSIM':>8}{'對浮點(dB)':>12}  結果"]
+    for r in results:
+        speedup = f"{r['speedup']:.2f}x" if r["speedup"] is not None else "-"
+        psnr_text = "-" if r["psnr"] is None else ("inf" if np.isinf(r["psnr"]) else f"{r['psnr']:.2f}")
+        ssim_text = "-" if r["ssim"] is None else f"{r['ssim']:.4f}"
+        fixed_text = "-" if r["fixed_psnr"] is None else f"{r['fixed_psnr']:.2f}"
+        status = "OK" if r["passed"] else "FAIL"
+        lines.append(f"{r['case']:<28}{r['ms']:>10.2f}{speedup:>8}{psnr_text:>10}{ssim_text:>8}{fixed_text:>12}  {status}")
+    return "\n".join(lines)
+
+
+def capture_fixture(image_path, name, asset_dir=ASSET_DIR, color_rgb=(200, 30, 60), opacity=0.7):
+    """從照片檢測人臉，將唇部輪廓加入夾具檔
+
+    Args:
+        image_path: 照片路徑
+        name: 夾具名稱
+        asset_dir: 夾具所在的目錄
+        color_rgb: 渲染時使用的口紅顏色
+        opacity: 渲染時使用的不透明度
+
+    Returns:
+        fixture: 新增的夾具，未檢測到人臉時返回None
+    """
+    # 只有擷取夾具時才需要載入MediaPipe
+    from app.utils.face_detection import FaceDetector
+
+    image = cv2.imread(image_path)
+    if image is None:
+        return None
+    detector = FaceDetector(max_num_faces=1)
+    faces = detector.detect_multiple_faces(image)
+    if not faces:
+        return None
+
+    landmarks = faces[0]
+    height, width = image.shape[:2]
+    fixture = {
+        "name": name,
+        "frame_shape": [height, width],
+        "mouth_closed": bool(detector._is_mouth_closed(landmarks, width, height)),
+        "color_rgb": list(color_rgb),
+        "opacity": opacity,
+        "outer": np.round(landmarks.pixel_points(width, height, detector._outer_lip_idx).astype(np.float64), 2).tolist(),
+        "inner": np.round(landmarks.pixel_points(width, height, detector._inner_lip_idx).astype(np.float64), 2).tolist(),
+    }
+
+    path = os.path.join(asset_dir, FIXTURES_FILE)
+    fixtures = []
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            fixtures = [item for item in json.load(f) if item["name"] != name]
+    fixtures.append(fixture)
+    os.makedirs(asset_dir, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        # 每個夾具一行，方便檢視差異
+        f.write("[\n" + ",\n".join(json.dumps(item) for item in fixtures) + "\n]\n")
+    return fixture
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="口紅渲染的黃金圖像回歸測試")
+    parser.add_argument("--update", action="store_true", help="以目前的渲染結果更新黃金輸出與基準耗時")
+    parser.add_argument("--repeat", type=int, default=20, help="每個案例的計時重複次數")
+    parser.add_argument("--seed", type=int, default=None, help="渲染器的紋理種子")
+    parser.add_argument("--min-psnr", type=float, default=40.0, help="可接受的最低PSNR (dB)")
+    parser.add_argument("--min-ssim", type=float, default=0.98, help="可接受的最低SSIM")
+    parser.add_argument("--min-fixed-psnr", type=float, default=45.0, help="定點結果相對浮點結果可接受的最低PSNR (dB)")
+    parser.add_argument("--assets", default=ASSET_DIR, help="夾具與黃金輸出所在的目錄")
+    parser.add_argument("--capture", metavar="IMAGE", help="從照片擷取唇部特徵點夾具")
+    parser.add_argument("--name", help="擷取夾具時使用的名稱")
+    args = parser.parse_args(argv)
+
+    if args.capture:
+        name = args.name or os.path.splitext(os.path.basename(args.capture))[0]
+        fixture = capture_fixture(args.capture, name, args.assets)
+        if fixture is None:
+            print(f"未能在 {args.capture} 中檢測到人臉")
+            return 1
+        print(f"已新增夾具 {name}，請以 --update 生成黃金輸出")
+        return 0
+
+    results = run(args.assets, args.update, args.repeat, args.seed, args.min_psnr, args.min_ssim,
+                  args.min_fixed_psnr)
+    print(format_results(results))
+    if args.update:
+        print(f"已更新 {len(results)} 個黃金輸出")
+    return 0 if all(r["passed"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+import cv2
+import numpy as np
+
+class SkinToneEstimator:
+    """膚色估計器
+    
+    在額頭與兩頰的多個特徵點周圍取樣，所有取樣區塊都來自同一張縮小後的
+    臉部裁切圖，只做一次HSV轉換並以向量化索引取值，再以中位數絕對偏差
+    剔除受陰影、頭髮或反光影響的異常樣本。視頻模式下以指數移動平均平滑，
+    並限制更新頻率
+    """
+    
+    # 額頭取樣點
+    FOREHEAD_POINTS = [10, 151, 9, 108, 337, 67, 297, 109, 338, 69, 299]
+    # 左臉頰取樣點
+    LEFT_CHEEK_POINTS = [50, 101, 118, 117, 123, 187, 205, 36, 142, 116]
+    # 右臉頰取樣點
+    RIGHT_CHEEK_POINTS = [280, 330, 347, 346, 352, 411, 425, 266, 371, 345]
+    
+    def __init__(self, max_crop_size=128, patch_ratio=0.04, outlier_threshold=2.5,
+                 smoothing=0.3, update_interval=1):
+        """初始化膚色估計器
+        
+        Args:
+            max_crop_size: 臉部裁切圖縮小後的最大邊長
+            patch_ratio: 取樣區塊半徑相對於兩頰距離的比例
+            outlier_threshold: 偏離中位數超過此倍數的MAD時視為異常樣本
+            smoothing: 視頻模式下新估計值的權重（0-1）
+            update_interval: 視頻模式下每隔多少幀重新估計一次
+        """
+        self.max_crop_size = max_crop_size
+        self.patch_ratio = patch_ratio
+        self.outlier_threshold = outlier_threshold
+        self.smoothing = smoothing
+        self.update_interval = update_interval
+        
+        self.sample_points = np.array(
+            self.FOREHEAD_POINTS + self.LEFT_CHEEK_POINTS + self.RIGHT_CHEEK_POINTS,
+            dtype=np.intp
+        )
+        
+        self.current = None
+        self._frame_count = 0
+    
+    def estimate(self, image, landmarks):
+        """估計單張圖像的膚色
+        
+        Args:
+            image: 輸入的BGR圖像
+            landmarks: FaceLandmarks面部特徵點
+        
+        Returns:
+            hsv_values: HSV色值，無法取樣時返回None
+        """
+        if landmarks is None or len(landmarks) <= self.sample_points.max():
+            return None
+        
+        height, width = image.shape[:2]
+        points = landmarks.pixel_points(width, height, self.sample_points)
+        
+        # 取樣區塊大小與臉部大小成比例
+        cheek_distance = np.linalg.norm(
+            landmarks.pixel_points(width, height, [123])[0] - landmarks.pixel_points(width, height, [352])[0]
+        )
+        radius = max(2.0, cheek_distance * self.patch_ratio)
+        
+        # 裁切涵蓋所有取樣區塊的臉部區域
+        x0 = int(max(0, np.floor(points[:, 0].min() - radius)))
+        y0 = int(max(0, np.floor(points[:, 1].min() - radius)))
+        x1 = int(min(width, np.ceil(points[:, 0].max() + radius) + 1))
+        y1 = int(min(height, np.ceil(points[:, 1].max() + radius) + 1))
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            return None
+        
+        crop = image[y0:y1, x0:x1]
+        scale = min(1.0, self.max_crop_size / max(crop.shape[:2]))
+        if scale < 1.0:
+            crop = cv2.resize(
+                crop, (max(1, int(crop.shape[1] * scale)), max(1, int(crop.shape[0] * scale))),
+                interpolation=cv2.INTER_AREA
+            )
+        
+        # 整個裁切圖只做一次色彩空間轉換
+        crop_hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
+        crop_h, crop_w = crop_hsv.shape[:2]
+        
+        # 以向量化索引一次取出所有區塊的像素 (P, k, k, 3)
+        r = max(1, int(round(radius * scale)))
+        offsets = np.arange(-r, r + 1)
+        centers = np.round((points - (x0, y0)) * scale).astype(np.intp)
+        xs = np.clip(centers[:, 0, None, None] + offsets[None, None, :], 0, crop_w - 1)
+        ys = np.clip(centers[:, 1, None, None] + offsets[None, :, None], 0, crop_h - 1)
+        samples = crop_hsv[ys, xs].reshape(len(centers), -1, 3).mean(axis=1)
+        
+        # 以中位數絕對偏差剔除異常樣本
+        median = np.median(samples, axis=0)
+        # 下限為1，避免樣本幾乎一致時把微小差異誤判為異常
+        mad = np.maximum(np.median(np.abs(samples - median), axis=0), 1.0)
+        inliers = np.all(np.abs(samples - median) <= self.outlier_threshold * 1.4826 * mad, axis=1)
+        if not inliers.any():
+            return median
+        
+        # 返回平均膚色
+        return samples[inliers].mean(axis=0)
+    
+    def update(self, image, landmarks):
+        """視頻模式下更新平滑後的膚色
+        
+        Args:
+            image: 輸入的BGR圖像
+            landmarks: FaceLandmarks面部特徵點
+        
+        Returns:
+            hsv_values: 目前平滑後的HSV色值
+            updated: 本幀是否重新估計了膚色
+        """
+        self._frame_count += 1
+        if self.current is not None and self._frame_count < self.update_interval:
+            return self.current, False
+        
+        hsv_values = self.estimate(image, landmarks)
+        if hsv_values is None:
+            return self.current, False
+        
+        self._frame_count = 0
+        if self.current is None:
+            self.current = hsv_values
+        else:
+            self.current = self.current + (hsv_values - self.current) * self.smoothing
+        return self.current, True
+    
+    def reset(self):
+        """清除視頻模式下的平滑狀態"""
+        self.current = None
+        self._frame_count = 0
\ No newline at end of file
@@ -12,33 +12,45 @@ import json
 from streamlit_image_comparison import image_comparison
 from streamlit_webrtc import webrtc_streamer, VideoTransformerBase, RTCConfiguration
 
-from app.utils.face_detection import FaceDetector
+from app.utils.face_detection import FaceDetector, FaceDetectorPool
 from app.utils.lipstick_renderer import LipstickRenderer
 from app.utils.recommendation import LipstickRecommender
-from app.utils.clahe_enhancer import CLAHEEnhancer
-from app.utils.lipstick_library import get_all_brands, get_colors_for_brand, get_color_rgb, get_texture
+from app.utils.lipstick_library import (
+    get_all_brands, get_colors_for_brand, get_color_rgb, get_texture,
+    get_default_strength_by_texture, get_shade, get_shade_index
+)
+from app.utils.detection_cache import DetectionCache
+from app.utils.lip_tracker import LipTracker
+from app.utils.skin_tone import SkinToneEstimator
+from app.utils.frame_buffer_pool import FrameBufferPool
 
-# 初始化核心組件
-face_detector = FaceDetector(max_num_faces=3)
-lipstick_renderer = LipstickRenderer()
-recommender = LipstickRecommender()
-clahe_enhancer = CLAHEEnhancer()
+# 初始化核心組件 - 以快取資源延遲建立，只在首次使用時載入模型，
+# 之後Streamlit重新執行腳本時直接重用，不會每次都重建MediaPipe模型
+@st.cache_resource
+def get_face_detector_pool():
+    # 各工作階段在不同執行緒中執行，每次檢測從池中借用獨立的檢測器，
+    # 不會同時使用同一個MediaPipe圖與緩衝
+    # 上傳照片啟用兩階段補檢：只有大圖且單階段漏檢人臉時，才以原圖精度定位其餘人臉
+    return FaceDetectorPool(max_num_faces=3, two_stage=True)
+
+@st.cache_resource
+def get_lipstick_renderer():
+    # 團體照的各張臉以執行緒池並行生成遮罩與渲染，執行緒數與最大人臉數一致
+    return LipstickRenderer(max_workers=3)
+
+@st.cache_resource
+def get_recommender():
+    return LipstickRecommender()
+
+# 檢測結果快取 - 跨重新執行保留，切換色號時不必重新檢測
+@st.cache_resource
+def get_detection_cache():
+    return DetectionCache(max_entries=8)
 
 # 設置緩存清理計時器
 LAST_CLEANUP_TIME = None
 CLEANUP_INTERVAL = 600  # 10分鐘
 
-# 根據質地類型獲取預設顯色強度
-def get_default_strength_by_texture(texture):
-    if texture == "matte":  # 霧面
-        return 0.3
-    elif texture == "gloss":  # 珠光
-        return 0.6
-    elif texture == "velvet":  # 絲絨
-        return 0.7
-    else:
-        return 0.4  # 默認值
-
 # 載入 Lottie 動畫
 def load_lottieurl(url):
     r = requests.get(url)
@@ -202,8 +214,15 @@ class LipstickVideoTransformer(VideoTransformerBase):
     def __init__(self):
         """初始化視頻轉換器"""
         # 初始化唇部檢測器
-        self.face_detector = FaceDetector(max_num_faces=3)  # 實時處理時支援多達3個人臉
-        self.lipstick_renderer = LipstickRenderer()
+        # 實時處理時支援多達3個人臉，並使用追蹤模式避免每幀重新檢測
+        self.face_detector = FaceDetector(max_num_faces=3, static_image_mode=False)
+        # 與幀解析度相同的緩衝重複使用，穩定狀態下每幀不再配置整張圖大小的陣列
+        self.buffer_pool = FrameBufferPool(num_slots=2)
+        # 每N幀才執行一次檢測，其餘幀以光流追蹤唇部特徵點
+        self.lip_tracker = LipTracker(self.face_detector, buffer_pool=self.buffer_pool)
+        # 膚色每10幀重新估計一次，並以移動平均平滑
+        self.skin_tone_estimator = SkinToneEstimator(smoothing=0.3, update_interval=10)
+        self.lipstick_renderer = LipstickRenderer(max_workers=3)
         self.current_lipstick = None
         self.current_skin_tone = None  # 儲存最近檢測到的膚色HSV值
         self.skin_tone_updated = False  # 標記是否更新了膚色
@@ -236,50 +255,39 @@ class LipstickVideoTransformer(VideoTransformerBase):
         img = frame.to_ndarray(format="bgr24")
         
         try:
-            # 改用detect_multiple_faces檢測多個人臉
-            all_landmarks = self.face_detector.detect_multiple_faces(img)
+            # 由追蹤器決定本幀要重新檢測還是以光流推移特徵點
+            all_landmarks = self.lip_tracker.update(img)
             
             if all_landmarks and len(all_landmarks) > 0:
-                # 創建結果圖像副本
-                result = img.copy()
-                
-                # 使用第一個人臉的膚色作為參考（用於推薦）
+                # 使用第一個人臉的膚色作為參考（用於推薦），定期更新並平滑
                 first_face = all_landmarks[0]
-                hsv_values = self.face_detector.get_skin_tone(img, first_face)
-                if hsv_values is not None:
+                hsv_values, updated = self.skin_tone_estimator.update(img, first_face)
+                if updated:
                     self.current_skin_tone = hsv_values
                     self.skin_tone_updated = True
                 
-                # 處理每個人臉
-                for landmarks in all_landmarks:
-                    # 獲取唇部遮罩
-                    lip_mask = self.face_detector.get_lip_mask(img, landmarks)
-                    
-                    if lip_mask is not None:
-                        # 獲取口紅顏色和質地
-                        color_rgb = get_color_rgb(
-                            self.current_lipstick['brand'], 
-                            self.current_lipstick['color']
-                        )
-                        
-                        # 應用口紅效果到當前人臉
-                        face_result = self.lipstick_renderer.apply_lipstick(
-                            result.copy(),
-                            lip_mask,
-                            color_rgb,
-                            texture_type=self.current_lipstick['texture'],
-                            opacity=self.current_lipstick['strength']
-                        )
-                        
-                        # 使用遮罩將處理後的唇部區域合併到最終結果
-                        mask_3channel = cv2.merge([lip_mask, lip_mask, lip_mask])
-                        mask_normalized = mask_3channel.astype(float) / 255.0
-                        
-                        # 在遮罩區域用處理後的臉部替換結果圖像
-                        result = (result * (1.0 - mask_normalized) + 
-                                face_result * mask_normalized).astype(np.uint8)
+                # 獲取每個人臉的唇部遮罩（只保存唇部外框內的小型遮罩）
+                lip_masks = self.lipstick_renderer.map_faces(
+                    lambda landmarks: self.face_detector.get_lip_mask_roi(img, landmarks),
+                    all_landmarks
+                )
+                
+                # 獲取口紅顏色和質地
+                color_rgb = get_color_rgb(
+                    self.current_lipstick['brand'], 
+                    self.current_lipstick['color']
+                )
                 
-                return result
+                # 在同一個輸出中一次為所有人臉套用口紅
+                return self.lipstick_renderer.apply_lipstick_faces(
+                    img,
+                    lip_masks,
+                    color_rgb,
+                    texture_type=self.current_lipstick['texture'],
+                    opacity=self.current_lipstick['strength'],
+                    precision="fixed",  # 視頻串流使用定點運算
+                    out=self.buffer_pool.get("output", img.shape)
+                )
                 
         except Exception as e:
             # 如發生錯誤，返回原始圖像
@@ -297,6 +305,9 @@ def main():
         layout="wide"
     )
     
+    # 推薦系統不依賴任何模型，可直接取得
+    recommender = get_recommender()
+    
     # 加載自定義CSS和背景
     try:
         set_background("app/assets/bg_pattern.png")
@@ -579,20 +590,10 @@ def main():
                     if details:
                         color_rgb = details["color_rgb"]
                         
-                        # 尋找最接近的品牌色號
-                        closest_brand = None
-                        closest_color = None
-                        min_distance = float('inf')
-                        
-                        for brand in all_brands:
-                            for color_name in get_colors_for_brand(brand):
-                                brand_rgb = get_color_rgb(brand, color_name)
-                                # 計算RGB距離
-                                distance = sum((a - b) ** 2 for a, b in zip(color_rgb, brand_rgb)) ** 0.5
-                                if distance < min_distance:
-                                    min_distance = distance
-                                    closest_brand = brand
-                                    closest_color = color_name
+                        # 以感知色差 (CIELAB ΔE) 尋找最接近的品牌色號
+                        closest = get_shade_index().nearest(color_rgb)
+                        closest_brand = str(closest['brand']) if closest is not None else None
+                        closest_color = str(closest['name']) if closest is not None else None
                         
                         if closest_brand and closest_color:
                             # 更新當前使用的口紅
@@ -708,10 +709,6 @@ def main():
         # 在後台設置固定的多人臉數量
         if 'max_faces' not in st.session_state:
             st.session_state['max_faces'] = 3
-        
-        # 確保人臉檢測器使用正確的設置
-        if face_detector.max_num_faces != st.session_state['max_faces']:
-            face_detector.reinitialize(max_num_faces=st.session_state['max_faces'])
     
     # 主要內容區域
     if st.session_state['webcam_mode']:
@@ -820,20 +817,10 @@ def main():
                         color_rgb = details["color_rgb"]
                         html_color = f"rgb{tuple(color_rgb)}"
                         
-                        # 尋找品牌和色號與推薦的RGB最接近的口紅
-                        closest_brand = None
-                        closest_color = None
-                        min_distance = float('inf')
-                        
-                        for brand in all_brands:
-                            for color_name in get_colors_for_brand(brand):
-                                brand_rgb = get_color_rgb(brand, color_name)
-                                # 計算RGB距離
-                                distance = sum((a - b) ** 2 for a, b in zip(color_rgb, brand_rgb)) ** 0.5
-                                if distance < min_distance:
-                                    min_distance = distance
-                                    closest_brand = brand
-                                    closest_color = color_name
+                        # 以感知色差尋找與推薦顏色最接近的品牌色號
+                        closest = get_shade_index().nearest(color_rgb)
+                        closest_brand = str(closest['brand']) if closest is not None else None
+                        closest_color = str(closest['name']) if closest is not None else None
                         
                         if closest_brand and closest_color:
                             texture = get_texture(closest_brand, closest_color)
@@ -860,20 +847,10 @@ def main():
                         color_rgb = details["color_rgb"]
                         html_color = f"rgb{tuple(color_rgb)}"
                         
-                        # 尋找品牌和色號與推薦的RGB最接近的口紅
-                        closest_brand = None
-                        closest_color = None
-                        min_distance = float('inf')
-                        
-                        for brand in all_brands:
-                            for color_name in get_colors_for_brand(brand):
-                                brand_rgb = get_color_rgb(brand, color_name)
-                                # 計算RGB距離
-                                distance = sum((a - b) ** 2 for a, b in zip(color_rgb, brand_rgb)) ** 0.5
-                                if distance < min_distance:
-                                    min_distance = distance
-                                    closest_brand = brand
-                                    closest_color = color_name
+                        # 以感知色差尋找與推薦顏色最接近的品牌色號
+                        closest = get_shade_index().nearest(color_rgb)
+                        closest_brand = str(closest['brand']) if closest is not None else None
+                        closest_color = str(closest['name']) if closest is not None else None
                         
                         if closest_brand and closest_color:
                             texture = get_texture(closest_brand, closest_color)
@@ -900,20 +877,10 @@ def main():
                         color_rgb = details["color_rgb"]
                         html_color = f"rgb{tuple(color_rgb)}"
                         
-                        # 尋找品牌和色號與推薦的RGB最接近的口紅
-                        closest_brand = None
-                        closest_color = None
-                        min_distance = float('inf')
-                        
-                        for brand in all_brands:
-                            for color_name in get_colors_for_brand(brand):
-                                brand_rgb = get_color_rgb(brand, color_name)
-                                # 計算RGB距離
-                                distance = sum((a - b) ** 2 for a, b in zip(color_rgb, brand_rgb)) ** 0.5
-                                if distance < min_distance:
-                                    min_distance = distance
-                                    closest_brand = brand
-                                    closest_color = color_name
+                        # 以感知色差尋找與推薦顏色最接近的品牌色號
+                        closest = get_shade_index().nearest(color_rgb)
+                        closest_brand = str(closest['brand']) if closest is not None else None
+                        closest_color = str(closest['name']) if closest is not None else None
                         
                         if closest_brand and closest_color:
                             texture = get_texture(closest_brand, closest_color)
@@ -940,7 +907,7 @@ def main():
                         
                     for color_name in get_colors_for_brand(brand):
                         rgb = get_color_rgb(brand, color_name)
-                        hsv_img = cv2.cvtColor(np.uint8([[rgb]]), cv2.COLOR_RGB2HSV)[0][0]
+                        hsv_img = get_shade(brand, color_name)['hsv']
                         
                         # 偏中性、不太艷麗的色調適合日常
                         if 30 < hsv_img[1] < 160 and 90 < hsv_img[2] < 220:
@@ -977,7 +944,7 @@ def main():
                         
                     for color_name in get_colors_for_brand(brand):
                         rgb = get_color_rgb(brand, color_name)
-                        hsv_img = cv2.cvtColor(np.uint8([[rgb]]), cv2.COLOR_RGB2HSV)[0][0]
+                        hsv_img = get_shade(brand, color_name)['hsv']
                         
                         # 高飽和度、高亮度的色調適合派對
                         if hsv_img[1] > 150 and hsv_img[2] > 160:
@@ -1010,7 +977,7 @@ def main():
                         
                     for color_name in get_colors_for_brand(brand):
                         rgb = get_color_rgb(brand, color_name)
-                        hsv_img = cv2.cvtColor(np.uint8([[rgb]]), cv2.COLOR_RGB2HSV)[0][0]
+                        hsv_img = get_shade(brand, color_name)['hsv']
                         
                         # 低飽和度、中等亮度的色調適合職場
                         if 20 < hsv_img[1] < 120 and 50 < hsv_img[2] < 160:
@@ -1186,31 +1153,62 @@ def main():
         else:
             image_cv = cv2.cvtColor(image_cv, cv2.COLOR_RGB2BGR)
         
-        # 顯示處理進度指示器
-        with st.spinner("正在檢測臉部..."):
-            # 檢測面部 - 改為檢測多個人臉
-            all_landmarks = face_detector.detect_multiple_faces(image_cv)
+        # 只在處理上傳照片時才建立檢測器與渲染器
+        face_detector_pool = get_face_detector_pool()
+        lipstick_renderer = get_lipstick_renderer()
+        detection_cache = get_detection_cache()
         
-        # 檢查是否找到面部
-            if not all_landmarks:
-                st.error("⚠️ 未檢測到面部！請上傳包含清晰面部的圖片。")
+        # 借出的檢測器在with區塊內只屬於本次執行，其他工作階段不會同時使用
+        with face_detector_pool.acquire() as face_detector:
+            # 確保人臉檢測器使用正確的設置
+            if face_detector.max_num_faces != st.session_state['max_faces']:
+                face_detector.reinitialize(max_num_faces=st.session_state['max_faces'])
+            
+            # 以圖片內容與檢測器設定作為快取鍵，調整色號或強度時重用檢測結果
+            cache_key = DetectionCache.make_key(
+                uploaded_file.getvalue(),
+                *face_detector.settings
+            )
+            detection = detection_cache.get(cache_key)
+            
+            if detection is None:
+                # 顯示處理進度指示器
+                with st.spinner("正在檢測臉部..."):
+                    # 檢測面部 - 改為檢測多個人臉
+                    all_landmarks = face_detector.detect_multiple_faces(image_cv)
+                    # 同時生成各人臉的唇部遮罩（多張臉時並行生成）
+                    lip_masks = lipstick_renderer.map_faces(
+                        lambda landmarks: face_detector.get_lip_mask_roi(image_cv, landmarks),
+                        all_landmarks
+                    )
+                    # 第一個人臉的膚色用於推薦，與檢測結果一併快取
+                    skin_tone = face_detector.get_skin_tone(image_cv, all_landmarks[0]) if all_landmarks else None
                 
-                # 提供更多幫助信息
-                st.markdown("""
-                <div style="background-color: #f8f9fa; padding: 15px; border-radius: 10px; margin-top: 20px;">
-                    <h4>💡 提示：</h4>
-                    <ul>
-                        <li>請確保照片中有清晰可見的人臉</li>
-                        <li>照片光線充足，避免過暗或過曝</li>
-                        <li>臉部朝向正面，避免角度過大</li>
-                        <li>避免過多遮擋物（如口罩、太陽眼鏡等）</li>
-                    </ul>
-                </div>
-                """, unsafe_allow_html=True)
-                return
+                detection = {"landmarks": all_landmarks, "lip_masks": lip_masks, "skin_tone": skin_tone}
+                detection_cache.put(cache_key, detection)
+        
+        all_landmarks = detection["landmarks"]
+        
+        # 檢查是否找到面部
+        if not all_landmarks:
+            st.error("⚠️ 未檢測到面部！請上傳包含清晰面部的圖片。")
+            
+            # 提供更多幫助信息
+            st.markdown("""
+            <div style="background-color: #f8f9fa; padding: 15px; border-radius: 10px; margin-top: 20px;">
+                <h4>💡 提示：</h4>
+                <ul>
+                    <li>請確保照片中有清晰可見的人臉</li>
+                    <li>照片光線充足，避免過暗或過曝</li>
+                    <li>臉部朝向正面，避免角度過大</li>
+                    <li>避免過多遮擋物（如口罩、太陽眼鏡等）</li>
+                </ul>
+            </div>
+            """, unsafe_allow_html=True)
+            return
         
-        # 處理每個檢測到的人臉
-        processed_faces = []
+        # 收集每個檢測到的人臉的唇部遮罩
+        lip_masks = []
         
         # 進度條展示處理進度
         progress_bar = st.progress(0)
@@ -1221,30 +1219,30 @@ def main():
             progress_value = (i) / len(all_landmarks)
             progress_bar.progress(progress_value)
             
-            # 獲取唇部遮罩
-            lip_mask = face_detector.get_lip_mask(image_cv, landmarks)
-            if lip_mask is None:
+            # 獲取唇部遮罩（來自檢測快取）
+            lip_mask_roi = detection["lip_masks"][i]
+            if lip_mask_roi is None:
                 st.warning(f"⚠️ 未能準確識別第 {i+1} 個人臉的唇部區域")
                 continue
-            
-            # 獲取當前口紅設置
-            current = st.session_state['current_lipstick']
-            color_rgb = get_color_rgb(current['brand'], current['color'])
-            
-            # 應用口紅效果
+            lip_masks.append(lip_mask_roi)
+        
+        # 獲取當前口紅設置
+        current = st.session_state['current_lipstick']
+        color_rgb = get_color_rgb(current['brand'], current['color'])
+        
+        # 在同一個輸出中一次為所有人臉套用口紅
+        final_result = None
+        if lip_masks:
             try:
-                result = lipstick_renderer.apply_lipstick(
-                    image_cv.copy(),
-                    lip_mask,
+                final_result = lipstick_renderer.apply_lipstick_faces(
+                    image_cv,
+                    lip_masks,
                     color_rgb,
                     texture_type=current['texture'],
                     opacity=current['strength']
                 )
-                
-                # 將處理後的人臉保存到列表
-                processed_faces.append(result)
             except Exception as e:
-                st.error(f"處理第 {i+1} 個人臉時出錯: {str(e)}")
+                st.error(f"套用口紅效果時出錯: {str(e)}")
         
         # 完成進度
         progress_bar.progress(1.0)
@@ -1254,32 +1252,7 @@ def main():
         progress_bar.empty()
         
         # 如果有成功處理的人臉
-        if processed_faces:
-            # 創建一個基於原始圖像的副本作為最終結果
-            final_result = image_cv.copy()
-            
-            # 修正多個人臉的處理方式
-            if len(processed_faces) == 1:
-                # 只有一個人臉時直接使用處理後的結果
-                final_result = processed_faces[0]
-            else:
-                # 多個人臉時，需要將每個人臉的修改合併到原圖
-                for i, face_result in enumerate(processed_faces):
-                    # 獲取當前臉部的唇部遮罩
-                    current_mask = face_detector.get_lip_mask(image_cv, all_landmarks[i])
-                    if current_mask is None:
-                        continue
-                        
-                    # 將遮罩擴展為3通道以適應圖像合併
-                    mask_3channel = cv2.merge([current_mask, current_mask, current_mask])
-                    
-                    # 使用遮罩將處理後的唇部區域合併到最終結果
-                    mask_normalized = mask_3channel.astype(float) / 255.0
-                    
-                    # 在遮罩區域用處理後的臉部替換原圖
-                    final_result = (final_result * (1.0 - mask_normalized) + 
-                                   face_result * mask_normalized).astype(np.uint8)
-            
+        if final_result is not None:
             # 轉換回PIL格式以顯示
             result_rgb = cv2.cvtColor(final_result, cv2.COLOR_BGR2RGB)
             result_image = Image.fromarray(result_rgb)
@@ -1340,7 +1313,7 @@ def main():
                     <div>
                         <h3 style="margin: 0; color: #333;">{current['brand']} {current['color']}</h3>
                         <p style="margin: 5px 0; color: #666;">質地: {texture_display} | 顯色強度: {current['strength']}</p>
-                        <p style="margin: 5px 0; font-size: 0.8rem; color: #888;">處理人臉數: {len(processed_faces)}</p>
+                        <p style="margin: 5px 0; font-size: 0.8rem; color: #888;">處理人臉數: {len(lip_masks)}</p>
                     </div>
                 </div>
                 """, unsafe_allow_html=True)
@@ -1383,15 +1356,15 @@ def main():
                     <div>
                         <h3 style="margin: 0; color: #333;">{current['brand']} {current['color']}</h3>
                         <p style="margin: 5px 0; color: #666;">質地: {texture_display} | 顯色強度: {current['strength']}</p>
-                        <p style="margin: 5px 0; font-size: 0.8rem; color: #888;">處理人臉數: {len(processed_faces)}</p>
+                        <p style="margin: 5px 0; font-size: 0.8rem; color: #888;">處理人臉數: {len(lip_masks)}</p>
                     </div>
                 </div>
                 """, unsafe_allow_html=True)
         
             # 獲取膚色並提供推薦
             with st.spinner("分析膚色..."):
-                # 使用第一個檢測到的人臉進行膚色分析
-                hsv_values = face_detector.get_skin_tone(image_cv, all_landmarks[0])
+                # 使用第一個檢測到的人臉進行膚色分析（檢測時已計算並快取）
+                hsv_values = detection["skin_tone"]
             
                 # 推薦區域
                 st.markdown("""
@@ -1439,7 +1412,7 @@ def main():
                             
                         for color_name in get_colors_for_brand(brand):
                             rgb = get_color_rgb(brand, color_name)
-                            hsv_img = cv2.cvtColor(np.uint8([[rgb]]), cv2.COLOR_RGB2HSV)[0][0]
+                            hsv_img = get_shade(brand, color_name)['hsv']
                             
                             # 偏中性、不太艷麗的色調適合日常
                             if 30 < hsv_img[1] < 160 and 90 < hsv_img[2] < 220:
@@ -1471,7 +1444,7 @@ def main():
                             
                         for color_name in get_colors_for_brand(brand):
                             rgb = get_color_rgb(brand, color_name)
-                            hsv_img = cv2.cvtColor(np.uint8([[rgb]]), cv2.COLOR_RGB2HSV)[0][0]
+                            hsv_img = get_shade(brand, color_name)['hsv']
                             
                             # 高飽和度、高亮度的色調適合派對
                             if hsv_img[1] > 150 and hsv_img[2] > 160:
@@ -1503,7 +1476,7 @@ def main():
                             
                         for color_name in get_colors_for_brand(brand):
                             rgb = get_color_rgb(brand, color_name)
-                            hsv_img = cv2.cvtColor(np.uint8([[rgb]]), cv2.COLOR_RGB2HSV)[0][0]
+                            hsv_img = get_shade(brand, color_name)['hsv']
                             
                             # 低飽和度、中等亮度的色調適合職場
                             if 20 < hsv_img[1] < 120 and 50 < hsv_img[2] < 160: